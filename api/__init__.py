@@ -1,5 +1,6 @@
 from . import api_request
+from . import rate_limiter
 from .slide_handler import SlideHandler
 
 
-__all__ = ['api_request', 'slide_handler']
\ No newline at end of file
+__all__ = ['api_request', 'rate_limiter', 'slide_handler']
\ No newline at end of file
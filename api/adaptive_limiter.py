@@ -0,0 +1,219 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+from monitoring.metrics import CONCURRENCY_LIMIT, CONCURRENCY_IN_FLIGHT, CONCURRENCY_LATENCY, CONCURRENCY_BACKOFFS
+
+DEFAULT_STATE_PATH = os.path.join("db", "concurrency.json")
+BACKOFF_FACTOR = 0.7  # The limit is multiplied by this factor on a rate limit, an error or a latency spike
+LATENCY_TOLERANCE = 2.0  # A request slower than this many times the average latency is a latency spike
+LATENCY_SMOOTHING = 0.05  # Weight of the last request in the average latency
+SAVE_INTERVAL = 10.0  # Seconds between two saves of the learned limit
+
+
+class Sample:
+    """
+    The outcome of a request measured by AdaptiveLimiter.measure(), set by the caller.
+    Attributes:
+        dropped (bool): True if the request was rate limited or failed on the server.
+    """
+
+    def __init__(self):
+        self.dropped = False
+
+
+class AdaptiveLimiter:
+    """
+    Limits the requests in flight with a limit learned from the responses (additive increase, multiplicative decrease).
+    Every successful request whose latency stays within LATENCY_TOLERANCE of the average latency raises the
+    limit by 1 / limit (about one more request per round trip), while the limit is in use. A rate limited or
+    failed request, or a latency spike, multiplies it by BACKOFF_FACTOR, at most once per average latency so a
+    burst of rejected requests backs off once. The learned limit is saved to a JSON file and loaded on start.
+    The limiter is shared by the worker threads of the explainer, each of them running its own event loop.
+    Attributes:
+        enabled (bool): False to let every request through.
+        limit (float): The current limit of requests in flight.
+        min_limit (int): The lowest limit.
+        max_limit (int): The highest limit.
+        latency (float): The moving average latency of the successful requests in seconds.
+        state_path (str | None): The JSON file of the learned limit, None to not persist it.
+    """
+
+    def __init__(self, enabled: bool = False, initial_limit: float = 10, min_limit: int = 1, max_limit: int = 200,
+                 state_path: str | None = None):
+        self.lock = threading.Lock()
+        self.waiters = deque()
+        self.in_flight = 0
+        self.last_backoff = 0.0
+        self.last_save = 0.0
+        self.configure(enabled, initial_limit, min_limit, max_limit, state_path)
+
+    def configure(self, enabled: bool, initial_limit: float = 10, min_limit: int = 1, max_limit: int = 200,
+                  state_path: str | None = None):
+        with self.lock:
+            self.enabled = enabled
+            self.min_limit = max(1, min_limit)
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = float(min(self.max_limit, max(self.min_limit, initial_limit)))
+            self.latency = 0.0
+            self.state_path = state_path
+        self.load()
+        self.export_metrics()
+
+    def load(self):
+        """
+        Loads the learned limit and average latency saved by a previous run, when there is one.
+        """
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, 'r') as file:
+                state = json.load(file)
+        except (OSError, ValueError):
+            return
+        with self.lock:
+            self.limit = float(min(self.max_limit, max(self.min_limit, state.get("limit", self.limit))))
+            self.latency = float(state.get("latency", 0.0))
+
+    def save(self):
+        """
+        Saves the learned limit and average latency, replacing the file atomically.
+        """
+        if not self.state_path:
+            return
+        with self.lock:
+            state = {"limit": round(self.limit, 3), "latency": round(self.latency, 4),
+                     "updated": datetime.now().isoformat(timespec="seconds")}
+            self.last_save = time.monotonic()
+        temporary_path = f"{self.state_path}.tmp"
+        with open(temporary_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temporary_path, self.state_path)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: The state of the limiter.
+        """
+        with self.lock:
+            return {"enabled": self.enabled, "limit": round(self.limit, 2), "in_flight": self.in_flight,
+                    "waiting": len(self.waiters), "latency_seconds": round(self.latency, 4),
+                    "min_limit": self.min_limit, "max_limit": self.max_limit}
+
+    def export_metrics(self):
+        CONCURRENCY_LIMIT.set(self.limit)
+        CONCURRENCY_IN_FLIGHT.set(self.in_flight)
+        CONCURRENCY_LATENCY.set(self.latency)
+
+    def available(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self):
+        """
+        Waits until a request can be sent within the limit.
+        """
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            if not self.waiters and self.available():
+                self.in_flight += 1
+                return
+            future = loop.create_future()
+            waiter = (loop, future)
+            self.waiters.append(waiter)
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self.lock:
+                if waiter in self.waiters:
+                    self.waiters.remove(waiter)
+                    raise
+            # The slot was granted: give it back now, or when the grant runs on the cancelled future
+            if future.done() and not future.cancelled():
+                self.release_slot()
+            raise
+
+    def grant(self, future: asyncio.Future):
+        if future.cancelled():
+            self.release_slot()
+        elif not future.done():
+            future.set_result(None)
+
+    def wake_waiters(self):
+        """
+        Grants the free slots to the waiting requests, in their arrival order. Called with the lock held.
+        """
+        while self.waiters and self.available():
+            loop, future = self.waiters.popleft()
+            self.in_flight += 1
+            try:
+                loop.call_soon_threadsafe(self.grant, future)
+            except RuntimeError:
+                # The event loop of the waiter was closed
+                self.in_flight -= 1
+
+    def release_slot(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.wake_waiters()
+        CONCURRENCY_IN_FLIGHT.set(self.in_flight)
+
+    def release(self, latency: float, dropped: bool):
+        """
+        Releases the slot of a finished request and adapts the limit to its outcome.
+        Args:
+            latency (float): The latency of the request in seconds.
+            dropped (bool): True if the request was rate limited or failed.
+        """
+        now = time.monotonic()
+        with self.lock:
+            self.in_flight -= 1
+            spike = bool(self.latency) and latency > self.latency * LATENCY_TOLERANCE
+            if dropped or spike:
+                if now - self.last_backoff >= self.latency:
+                    self.limit = max(self.min_limit, self.limit * BACKOFF_FACTOR)
+                    self.last_backoff = now
+                    CONCURRENCY_BACKOFFS.inc(reason="dropped" if dropped else "latency")
+            elif self.in_flight + 1 >= self.limit / 2:
+                # Only grow while the limit is in use, an idle limiter would otherwise grow forever
+                self.limit = min(self.max_limit, self.limit + 1 / self.limit)
+            if not dropped:
+                self.latency = latency if not self.latency else \
+                    (1 - LATENCY_SMOOTHING) * self.latency + LATENCY_SMOOTHING * latency
+            self.wake_waiters()
+            save = now - self.last_save >= SAVE_INTERVAL
+        self.export_metrics()
+        if save:
+            self.save()
+
+    @asynccontextmanager
+    async def measure(self):
+        """
+        Sends the enclosed request within the limit and adapts the limit to its latency and outcome.
+        The caller marks rate limited or failed responses with sample.dropped, exceptions count as dropped.
+        Does nothing but yield the sample when the limiter is disabled.
+        Yields:
+            Sample: The outcome of the request.
+        """
+        sample = Sample()
+        if not self.enabled:
+            yield sample
+            return
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield sample
+        except asyncio.CancelledError:
+            self.release_slot()
+            raise
+        except Exception:
+            self.release(time.perf_counter() - start, dropped=True)
+            raise
+        self.release(time.perf_counter() - start, sample.dropped)
+
+
+concurrency_limiter = AdaptiveLimiter()
@@ -1,28 +1,162 @@
-import aiohttp
-import os
-import openai
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+from api.adaptive_limiter import concurrency_limiter
+from api.provider_router import router, Provider, FAILOVER_STATUSES
+from api.rate_limiter import RateLimiter
+from monitoring.metrics import API_REQUEST_SECONDS, API_REQUESTS, API_TOKENS
+from monitoring.tracing import span
+
+NO_LIMIT = RateLimiter()
+INVALID_RESPONSE = "invalid"  # The failover reason of a response whose body is not a JSON object
+_shared_session = ContextVar("api_shared_session", default=None)
+_rate_limiter = ContextVar("api_rate_limiter", default=None)
 
 
 class ApiRequest:
     @staticmethod
-    async def generate_text(prompt: str):
+    @asynccontextmanager
+    async def client(max_connections: int = 100, rate_limiter: RateLimiter = None):
+        """
+        Shares one connection pool (and optionally a rate limiter) between all the requests
+        made inside the block, including the tasks it creates.
+        Outside of it every request opens its own connection.
+        Args:
+            max_connections (int): The size of the connection pool.
+            rate_limiter (RateLimiter, optional): Limits the requests made inside the block.
+        Yields:
+            aiohttp.ClientSession: The shared session.
+        """
+        import aiohttp
+        async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=max_connections)) as session:
+            session_token = _shared_session.set(session)
+            limiter_token = _rate_limiter.set(rate_limiter)
+            try:
+                yield session
+            finally:
+                _rate_limiter.reset(limiter_token)
+                _shared_session.reset(session_token)
+
+    @staticmethod
+    async def generate_text(prompt: str, max_tokens: int = None):
         """
-        Generates text using the OpenAI API based on the given prompt.
+        Generates text using the OpenAI API (or the providers of the provider router) based on the given prompt.
+        The request uses the shared session of ApiRequest.client() when there is one.
+        The latency, HTTP status code and token usage of the request are recorded in the metrics.
         Args:
             prompt (str): The prompt for text generation.
+            max_tokens (int, optional): Lowers the maximum completion tokens of the provider, e.g. for summaries.
         Returns:
             dict: The response JSON object containing the generated text.
         Raises:
             aiohttp.ClientError: If there is an error during the API request.
         """
-        openai.api_key = os.getenv("API_KEY")
-        engine = "gpt-3.5-turbo"
-        max_tokens = 512
-        async with aiohttp.ClientSession() as session:
-            response = await session.post(
-                "https://api.openai.com/v1/chat/completions",
-                headers={"Authorization": f"Bearer {openai.api_key}", "Content-Type": "application/json"},
-                json={
-                    "messages": [{"role": "system", "content": "You are a helpful assistant."},
-                                 {"role": "user", "content": prompt}], "max_tokens": max_tokens, "model": engine})
-            return await response.json()
+        import aiohttp  # Imported on the first request, the web app never needs it
+        async with _rate_limiter.get() or NO_LIMIT:
+            session = _shared_session.get()
+            if session is not None:
+                return await ApiRequest.post_prompt(session, prompt, max_tokens)
+            async with aiohttp.ClientSession() as session:
+                return await ApiRequest.post_prompt(session, prompt, max_tokens)
+
+    @staticmethod
+    async def post_prompt(session, prompt: str, max_tokens: int = None) -> dict:
+        """
+        Posts the prompt to the chat completions endpoint of a provider picked by the provider router,
+        within the adaptive concurrency limit when it is enabled.
+        Rate limited, failing and slow requests fail over to another provider (or the same one after
+        its cooldown), up to router.max_attempts attempts.
+        Args:
+            session (aiohttp.ClientSession): The session to send the request with.
+            prompt (str): The prompt for text generation.
+            max_tokens (int, optional): Lowers the maximum completion tokens of the provider.
+        Returns:
+            dict: The response JSON object containing the generated text, or the error of the last attempt.
+        Raises:
+            aiohttp.ClientError, asyncio.TimeoutError: If the last attempt fails to connect or times out.
+        """
+        import aiohttp
+        tried = set()
+        for attempt in range(1, router.max_attempts + 1):
+            provider = await router.acquire(tried)
+            tried.add(provider.name)
+            last_attempt = attempt == router.max_attempts
+            try:
+                async with concurrency_limiter.measure() as sample:
+                    status, response_json, retry_after = await ApiRequest.post_to_provider(session, provider, prompt,
+                                                                                           max_tokens)
+                    # A body that is not a JSON object (e.g. the HTML error page of a proxy) fails over too
+                    failed = response_json is None or status in FAILOVER_STATUSES
+                    sample.dropped = failed
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                router.record_failure(provider, "timeout" if isinstance(e, asyncio.TimeoutError) else "connection")
+                if last_attempt:
+                    raise
+                continue
+            if failed and not last_attempt:
+                router.record_failure(provider, str(status) if status in FAILOVER_STATUSES else INVALID_RESPONSE,
+                                      retry_after)
+                continue
+            if response_json is None:
+                return {"error": {"message": f"Invalid response from {provider.name} (HTTP {status})"}}
+            return response_json
+
+    @staticmethod
+    async def post_to_provider(session, provider: Provider, prompt: str,
+                               max_tokens: int = None) -> tuple[int, dict, float | None]:
+        """
+        Posts the prompt to a single provider, and records its latency and health.
+        Args:
+            session (aiohttp.ClientSession): The session to send the request with.
+            provider (Provider): The provider of the request.
+            prompt (str): The prompt for text generation.
+            max_tokens (int, optional): Lowers the maximum completion tokens of the provider.
+        Returns:
+            tuple[int, dict | None, float | None]: The HTTP status code, the response JSON object (None if the body
+                                                   is not a JSON object) and the Retry-After of the response in seconds.
+        """
+        import aiohttp
+        status = "error"
+        start = time.perf_counter()
+        try:
+            with span("request", provider=provider.name, model=provider.model):
+                response = await session.post(
+                    f"{provider.base_url}/chat/completions",
+                    headers={"Authorization": f"Bearer {provider.api_key}", "Content-Type": "application/json"},
+                    json={
+                        "messages": [{"role": "system", "content": "You are a helpful assistant."},
+                                     {"role": "user", "content": prompt}],
+                        "max_tokens": min(provider.max_tokens, max_tokens or provider.max_tokens),
+                        "model": provider.model},
+                    timeout=aiohttp.ClientTimeout(total=provider.timeout))
+            status = str(response.status)
+            with span("response", status=status):
+                try:
+                    response_json = await response.json(content_type=None)
+                except ValueError:
+                    response_json = None
+        finally:
+            API_REQUEST_SECONDS.observe(time.perf_counter() - start, status=status)
+            API_REQUESTS.inc(status=status)
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if not isinstance(response_json, dict):
+            return response.status, None, retry_after
+        if response.status < 400:
+            router.record_success(provider, time.perf_counter() - start)
+        usage = response_json.get("usage") or {}
+        API_TOKENS.inc(usage.get("prompt_tokens", 0), kind="prompt")
+        API_TOKENS.inc(usage.get("completion_tokens", 0), kind="completion")
+        return response.status, response_json, retry_after
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """
+    Returns:
+        float | None: The seconds of a Retry-After header, None if it is missing or an HTTP date.
+    """
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
@@ -1,11 +1,17 @@
 """
 prompt_generator.py
 
-This module generates prompts for slide rewriting.
+This module generates prompts for slide rewriting, and the slide summaries and deck context
+of the cross-slide context mode.
 """
+SUMMARY_MAX_TOKENS = 60  # Maximum completion tokens of a slide summary
+CONTEXT_MAX_TOKENS = 256  # Maximum estimated tokens of the deck context added to a slide prompt
+CONTEXT_SLIDES_BEFORE = 3  # Previous slides whose summaries are in the context of a slide
+CONTEXT_SLIDES_AFTER = 1  # Next slides whose summaries are in the context of a slide
+CHARS_PER_TOKEN = 4  # Rough number of characters of a token, used to cap the context
 
 
-def get_prompt(slide_content: str, slide_index: int, custom_prompt: str = "") -> str:
+def get_prompt(slide_content: str, slide_index: int, custom_prompt: str = "", deck_context: str = "") -> str:
     """
     Generates a prompt for rewriting a slide in a more improved way.
     Args:
@@ -13,6 +19,7 @@ def get_prompt(slide_content: str, slide_index: int, custom_prompt: str = "") ->
         slide_index (int): The index or page number of the slide.
         custom_prompt (str, optional): An optional custom prompt provided by the user.
                                        If not specified, a default prompt will be used.
+        deck_context (str, optional): The outline of the surrounding slides, see get_deck_context().
     Returns:
         str: The generated prompt for rewriting the slide.
     """
@@ -20,4 +27,69 @@ def get_prompt(slide_content: str, slide_index: int, custom_prompt: str = "") ->
         custom_prompt = f"Rewrite the following page in a better way:"
     page_slide = 'Slide' if 'slide' in custom_prompt else 'Page'
     prompt = f"{custom_prompt}\n{page_slide} number: {slide_index}\n{slide_content}"
+    if deck_context:
+        prompt = f"Outline of the surrounding {page_slide.lower()}s, for context only:\n{deck_context}\n\n{prompt}"
     return prompt
+
+
+def get_summary_prompt(slide_content: str, slide_index: int) -> str:
+    """
+    Generates a prompt for a one sentence summary of a slide, used in the context of the other slides.
+    Args:
+        slide_content (str): The content of the slide.
+        slide_index (int): The index or page number of the slide.
+    Returns:
+        str: The generated prompt.
+    """
+    return f"Summarize the topic of the following page in one short sentence:\nPage number: {slide_index}\n" \
+           f"{slide_content}"
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def get_context_slides(slide_index: int, slide_count: int) -> list[int]:
+    """
+    Returns the slides whose summaries form the context of a slide, the nearest first:
+    the previous and next slides, then the first slide (usually the title of the deck).
+    Args:
+        slide_index (int): The 1-based index of the slide.
+        slide_count (int): The number of slides of the deck.
+    Returns:
+        list[int]: The 1-based indexes of the context slides.
+    """
+    context_slides = []
+    for distance in range(1, max(CONTEXT_SLIDES_BEFORE, CONTEXT_SLIDES_AFTER) + 1):
+        if distance <= CONTEXT_SLIDES_BEFORE and slide_index - distance >= 1:
+            context_slides.append(slide_index - distance)
+        if distance <= CONTEXT_SLIDES_AFTER and slide_index + distance <= slide_count:
+            context_slides.append(slide_index + distance)
+    if slide_index != 1 and 1 not in context_slides:
+        context_slides.append(1)
+    return context_slides
+
+
+def get_deck_context(summaries: dict[int, str], max_tokens: int = CONTEXT_MAX_TOKENS) -> str:
+    """
+    Builds the outline of the context slides, in slide order, within a token budget.
+    The summaries are added nearest slide first (the order of the dict) until the budget is used.
+    Args:
+        summaries (dict[int, str]): The summary of each context slide, nearest first, see get_context_slides().
+        max_tokens (int, optional): The maximum estimated tokens of the outline.
+    Returns:
+        str: One "Page <index>: <summary>" line per included slide.
+    """
+    lines = {}
+    used = 0
+    for slide_index, summary in summaries.items():
+        summary = " ".join(summary.split())
+        if not summary:
+            continue
+        line = f"Page {slide_index}: {summary}"
+        tokens = estimate_tokens(line) + 1
+        if used + tokens > max_tokens:
+            break
+        lines[slide_index] = line
+        used += tokens
+    return "\n".join(lines[slide_index] for slide_index in sorted(lines))
@@ -0,0 +1,216 @@
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+
+from monitoring.metrics import API_FAILOVERS, API_PROVIDER_HEALTHY
+
+DEFAULT_API_BASE_URL = "https://api.openai.com/v1"
+DEFAULT_MODEL = "gpt-3.5-turbo"
+DEFAULT_MAX_TOKENS = 512
+DEFAULT_TIMEOUT = 60.0  # Seconds before a request is abandoned and sent to another provider
+FAILOVER_STATUSES = (429, 500, 502, 503, 504)  # Responses retried on another provider
+MIN_COOLDOWN = 1.0  # Seconds a failing provider is skipped, doubled on every consecutive failure
+MAX_COOLDOWN = 60.0
+LATENCY_SMOOTHING = 0.2  # Weight of the last request in the moving average latency of a provider
+
+
+class Provider:
+    """
+    An OpenAI compatible chat completions endpoint: an API key, a base URL and a model.
+    Attributes:
+        name (str): The name of the provider in the metrics and traces.
+        base_url (str): The base URL of the API, e.g. a self-hosted server.
+        api_key (str): The API key.
+        model (str): The model of the requests.
+        max_tokens (int): The maximum number of completion tokens of the requests.
+        weight (float): The share of the requests the provider receives among the providers of its tier.
+        tier (int): Providers of the lowest tier with a healthy provider are used, the higher tiers are fallbacks.
+        timeout (float): Requests slower than timeout seconds fail over to another provider.
+        slow_seconds (float): Above this moving average latency the weight of the provider is reduced, 0 to disable.
+    """
+
+    def __init__(self, name: str, base_url: str = DEFAULT_API_BASE_URL, api_key: str = "",
+                 model: str = DEFAULT_MODEL, max_tokens: int = DEFAULT_MAX_TOKENS, weight: float = 1.0, tier: int = 0,
+                 timeout: float = DEFAULT_TIMEOUT, slow_seconds: float = 0.0):
+        self.name = name
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.model = model
+        self.max_tokens = max_tokens
+        self.weight = weight
+        self.tier = tier
+        self.timeout = timeout
+        self.slow_seconds = slow_seconds
+        self.failures = 0
+        self.cooldown_until = 0.0
+        self.latency = 0.0
+
+    @classmethod
+    def from_config(cls, config: dict, index: int) -> "Provider":
+        """
+        Creates a provider from an entry of API_PROVIDERS. The key is read from the environment
+        variable named by "api_key_env" (API_KEY by default), so it is not written in the configuration.
+        """
+        return cls(name=config.get("name", f"provider{index}"),
+                   base_url=config.get("base_url", DEFAULT_API_BASE_URL),
+                   api_key=config.get("api_key") or os.getenv(config.get("api_key_env", "API_KEY"), ""),
+                   model=config.get("model", DEFAULT_MODEL),
+                   max_tokens=int(config.get("max_tokens", DEFAULT_MAX_TOKENS)),
+                   weight=float(config.get("weight", 1.0)),
+                   tier=int(config.get("tier", 0)),
+                   timeout=float(config.get("timeout", DEFAULT_TIMEOUT)),
+                   slow_seconds=float(config.get("slow_seconds", 0.0)))
+
+    def healthy(self, now: float) -> bool:
+        return self.cooldown_until <= now
+
+    def effective_weight(self) -> float:
+        """
+        Returns:
+            float: The weight of the provider, reduced in proportion when its latency is above slow_seconds.
+        """
+        if self.slow_seconds and self.latency > self.slow_seconds:
+            return self.weight * self.slow_seconds / self.latency
+        return self.weight
+
+
+class ProviderRouter:
+    """
+    Spreads the requests over several providers (API keys, endpoints or models).
+    Each request goes to a provider of the lowest tier that has a healthy provider, picked at random
+    in proportion to the provider weights. A provider that answers with a rate limit or server error,
+    fails to connect or is slower than its timeout is skipped for a cooldown (the Retry-After of the
+    response, or an exponential backoff), and the request fails over to another provider.
+    The state is shared by the worker threads of the explainer, each of them running its own event loop.
+    """
+
+    def __init__(self, providers: list[Provider] = None, seed: int = None):
+        self.lock = threading.Lock()
+        self.random = random.Random(seed)
+        self.providers = providers
+
+    def configure(self, providers: list[Provider] | None):
+        """
+        Args:
+            providers (list[Provider] | None): The providers, None to load them from the environment on first use.
+        """
+        with self.lock:
+            self.providers = providers
+        for provider in providers or []:
+            API_PROVIDER_HEALTHY.set(1, provider=provider.name)
+
+    def get_providers(self) -> list[Provider]:
+        """
+        Returns:
+            list[Provider]: The providers, loaded from the environment on first use.
+        """
+        if self.providers is None:
+            self.configure(load_providers())
+        return self.providers
+
+    def choose(self, exclude: set[str] = frozenset()) -> Provider | None:
+        """
+        Picks the provider of the next request.
+        Args:
+            exclude (set[str]): The names of the providers already tried by the request.
+        Returns:
+            Provider | None: A healthy provider, or None if every provider that was not tried is cooling down.
+        """
+        providers = self.get_providers()
+        now = time.monotonic()
+        with self.lock:
+            healthy = [provider for provider in providers
+                       if provider.name not in exclude and provider.healthy(now)]
+            if not healthy:
+                return None
+            tier = min(provider.tier for provider in healthy)
+            candidates = [provider for provider in healthy if provider.tier == tier]
+            weights = [provider.effective_weight() for provider in candidates]
+            if sum(weights) <= 0:
+                return candidates[0]
+            return self.random.choices(candidates, weights=weights)[0]
+
+    def next_recovery(self) -> float:
+        """
+        Returns:
+            float: The seconds until the first provider leaves its cooldown.
+        """
+        providers = self.get_providers()
+        with self.lock:
+            return max(0.0, min(provider.cooldown_until for provider in providers) - time.monotonic())
+
+    def record_success(self, provider: Provider, latency: float):
+        with self.lock:
+            provider.failures = 0
+            provider.latency = latency if not provider.latency else \
+                (1 - LATENCY_SMOOTHING) * provider.latency + LATENCY_SMOOTHING * latency
+        API_PROVIDER_HEALTHY.set(1, provider=provider.name)
+
+    def record_failure(self, provider: Provider, reason: str, retry_after: float = None):
+        """
+        Puts a provider in cooldown and counts the failover.
+        The failures of requests that were already in flight when the cooldown started don't extend it,
+        so a burst of concurrent rate limited requests counts as a single failure.
+        Args:
+            provider (Provider): The provider that failed.
+            reason (str): The failure, an HTTP status code, "timeout" or "connection".
+            retry_after (float, optional): The cooldown asked by the provider, in seconds.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if provider.cooldown_until > now:
+                API_FAILOVERS.inc(provider=provider.name, reason=reason)
+                return
+            provider.failures += 1
+            cooldown = retry_after if retry_after is not None else MIN_COOLDOWN * 2 ** (provider.failures - 1)
+            provider.cooldown_until = now + min(MAX_COOLDOWN, cooldown)
+        API_FAILOVERS.inc(provider=provider.name, reason=reason)
+        API_PROVIDER_HEALTHY.set(0, provider=provider.name)
+
+    async def acquire(self, tried: set[str]) -> Provider:
+        """
+        Picks the provider of the next attempt of a request, waiting for a cooldown to end
+        when every provider is cooling down. The providers not tried by the request go first.
+        Args:
+            tried (set[str]): The names of the providers already tried by the request.
+        Returns:
+            Provider: The provider of the attempt.
+        """
+        provider = self.choose(tried) or self.choose()
+        while provider is None:
+            await asyncio.sleep(self.next_recovery())
+            provider = self.choose()
+        return provider
+
+    @property
+    def max_attempts(self) -> int:
+        """
+        Returns:
+            int: The attempts of a request before its last error is returned, at least one per provider.
+        """
+        return max(3, len(self.get_providers()) + 1)
+
+
+def load_providers() -> list[Provider]:
+    """
+    Loads the providers from the API_PROVIDERS environment variable, a JSON list of provider settings
+    (name, base_url, api_key_env, model, max_tokens, weight, tier, timeout, slow_seconds).
+    Without it, a single provider is created from API_KEY, API_BASE_URL, API_MODEL and API_MAX_TOKENS.
+    Returns:
+        list[Provider]: The providers.
+    """
+    providers_config = os.getenv("API_PROVIDERS", "").strip()
+    if providers_config:
+        return [Provider.from_config(config, index) for index, config in enumerate(json.loads(providers_config))]
+    return [Provider(name="default",
+                     base_url=os.getenv("API_BASE_URL", DEFAULT_API_BASE_URL),
+                     api_key=os.getenv("API_KEY", ""),
+                     model=os.getenv("API_MODEL", DEFAULT_MODEL),
+                     max_tokens=int(os.getenv("API_MAX_TOKENS", str(DEFAULT_MAX_TOKENS))),
+                     timeout=float(os.getenv("API_TIMEOUT", str(DEFAULT_TIMEOUT))))]
+
+
+router = ProviderRouter()
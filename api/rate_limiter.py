@@ -0,0 +1,33 @@
+import asyncio
+
+
+class RateLimiter:
+    """
+    Limits the API requests shared by many documents: at most max_in_flight requests at once,
+    started at no more than requests_per_second. A value of 0 disables the corresponding limit.
+    Used as an async context manager around each request.
+    """
+
+    def __init__(self, max_in_flight: int = 0, requests_per_second: float = 0.0):
+        self.max_in_flight = max_in_flight
+        self.requests_per_second = requests_per_second
+        self.semaphore = asyncio.Semaphore(max_in_flight) if max_in_flight > 0 else None
+        self.lock = asyncio.Lock()
+        self.next_start = 0.0
+
+    async def __aenter__(self):
+        if self.semaphore is not None:
+            await self.semaphore.acquire()
+        if self.requests_per_second > 0:
+            async with self.lock:
+                now = asyncio.get_running_loop().time()
+                start = max(now, self.next_start)
+                self.next_start = start + 1 / self.requests_per_second
+            if start > now:
+                await asyncio.sleep(start - now)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self.semaphore is not None:
+            self.semaphore.release()
+        return False
@@ -1,8 +1,22 @@
-from api.prompt_generator import get_prompt
+from api.prompt_generator import get_prompt, get_summary_prompt, get_context_slides, get_deck_context
+from api.prompt_generator import estimate_tokens, SUMMARY_MAX_TOKENS
 from api.api_request import ApiRequest
+from monitoring.metrics import DECK_CONTEXT_TOKENS
+from monitoring.tracing import span
 import asyncio
 
 
+def get_response_text(response: dict) -> str:
+    """
+    Returns:
+        str: The generated text of a successful response, or an empty string.
+    """
+    choices = response.get("choices")
+    if isinstance(choices, list) and choices:
+        return choices[0].get("message", {}).get("content") or ""
+    return ""
+
+
 class SlideHandler:
     @staticmethod
     async def process_slide(slide_content: str, slide_index: int, custom_prompt: str = "") -> dict:
@@ -17,27 +31,163 @@ class SlideHandler:
             dict: The response received from the OpenAI API.
         """
         if slide_content.strip():
-            return await ApiRequest.generate_text(get_prompt(slide_content, slide_index, custom_prompt))
+            with span("slide", lane=slide_index, slide=slide_index):
+                with span("prompt"):
+                    prompt = get_prompt(slide_content, slide_index, custom_prompt)
+                return await ApiRequest.generate_text(prompt)
         return {"choices": {"message": {"content": f"{slide_index}"}}}
 
     @staticmethod
-    async def response_handler(slides: list[str], custom_prompt: str = "") -> list[dict]:
+    async def summarize_slide(slide_content: str, slide_index: int) -> tuple[str, dict]:
+        """
+        Requests a short summary of a slide, for the deck context of the other slides.
+        A failed summary is empty, the slides that use it are explained with a shorter context.
+        Args:
+            slide_content (str): The content of the slide.
+            slide_index (int): The index or page number of the slide.
+        Returns:
+            tuple[str, dict]: The summary and the token usage of its request.
+        """
+        if not slide_content.strip():
+            return "", {}
+        with span("summary", lane=slide_index, slide=slide_index):
+            try:
+                response = await ApiRequest.generate_text(get_summary_prompt(slide_content, slide_index),
+                                                          max_tokens=SUMMARY_MAX_TOKENS)
+            except Exception as e:
+                print(f"Error in summarize_slide: {e}")
+                return "", {}
+        usage = response.get("usage") or {}
+        DECK_CONTEXT_TOKENS.inc(usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0), kind="summary")
+        return get_response_text(response), usage
+
+    @staticmethod
+    async def process_slide_in_deck(slide_content: str, slide_index: int, custom_prompt: str,
+                                    summaries: list[asyncio.Task]) -> dict:
+        """
+        Processes a slide with the outline of the surrounding slides in its prompt.
+        The slide only waits for the summaries of its context slides, so the explanations start
+        while the summaries of the rest of the deck are still running.
+        Args:
+            slide_content (str): The content of the slide to be processed.
+            slide_index (int): The index or page number of the slide.
+            custom_prompt (str): An optional custom prompt for text generation.
+            summaries (list[asyncio.Task]): The summary tasks of every slide of the deck, see summarize_slide().
+        Returns:
+            dict: The response received from the OpenAI API, with the estimated tokens of its context
+                  in "context_tokens".
+        """
+        if not slide_content.strip():
+            return await SlideHandler.process_slide(slide_content, slide_index, custom_prompt)
+        context_summaries = {}
+        for context_index in get_context_slides(slide_index, len(summaries)):
+            # Shielded, the summary is shared with the other slides if this slide is cancelled
+            summary, _ = await asyncio.shield(summaries[context_index - 1])
+            context_summaries[context_index] = summary
+        deck_context = get_deck_context(context_summaries)
+        with span("slide", lane=slide_index, slide=slide_index):
+            with span("prompt"):
+                prompt = get_prompt(slide_content, slide_index, custom_prompt, deck_context)
+            response = await ApiRequest.generate_text(prompt)
+        context_tokens = estimate_tokens(deck_context)
+        DECK_CONTEXT_TOKENS.inc(context_tokens, kind="context")
+        return dict(response, context_tokens=context_tokens)
+
+    @staticmethod
+    async def reuse_slide(content: str) -> dict:
+        """
+        Returns:
+            dict: A previous explanation of an unchanged slide, in the shape of an API response.
+        """
+        return {"choices": [{"message": {"content": content}}], "reused": True}
+
+    @staticmethod
+    def create_slide_tasks(slides: list[str], custom_prompt: str = "", deck_context: bool = False,
+                           reused: dict[int, str] = None) -> tuple[list[asyncio.Task], list[asyncio.Task]]:
+        """
+        Creates the tasks that explain the slides of a file.
+        In the cross-slide context mode, every slide is first summarized in parallel, and each slide is
+        explained with the outline of its surrounding slides as soon as their summaries are ready.
+        Args:
+            slides (list[str]): A list of slide contents.
+            custom_prompt (str, optional): An optional custom prompt for text generation.
+            deck_context (bool, optional): True for the cross-slide context mode.
+            reused (dict[int, str], optional): The previous explanations of the unchanged slides, by slide number,
+                                               which are not requested again.
+        Returns:
+            tuple[list[asyncio.Task], list[asyncio.Task]]: The explanation tasks and the summary tasks of the slides.
+        """
+        if not deck_context:
+            reused = reused or {}
+            return [asyncio.create_task(SlideHandler.reuse_slide(reused[slide_index]) if slide_index in reused
+                                        else SlideHandler.process_slide(slide_content, slide_index, custom_prompt))
+                    for slide_index, slide_content in enumerate(slides, start=1)], []
+        summaries = [asyncio.create_task(SlideHandler.summarize_slide(slide_content, slide_index))
+                     for slide_index, slide_content in enumerate(slides, start=1)]
+        return [asyncio.create_task(SlideHandler.process_slide_in_deck(slide_content, slide_index, custom_prompt,
+                                                                       summaries))
+                for slide_index, slide_content in enumerate(slides, start=1)], summaries
+
+    @staticmethod
+    async def add_summary_usage(responses: list[dict], summaries: list[asyncio.Task]) -> list[dict]:
+        """
+        Adds the token usage of the summary of each slide to its response, as "summary_usage".
+        Returns:
+            list[dict]: The responses.
+        """
+        for response, (_, usage) in zip(responses, await asyncio.gather(*summaries)):
+            response["summary_usage"] = usage
+        return responses
+
+    @staticmethod
+    async def response_handler(slides: list[str], custom_prompt: str = "", deck_context: bool = False) -> list[dict]:
         """
         Handles the responses from the OpenAI API for each slide.
         Args:
             slides (list[str]): A list of slide contents.
             custom_prompt (str, optional): An optional custom prompt for text generation.
                                           If not specified, a default prompt will be used.
+            deck_context (bool, optional): True to explain the slides with the outline of the surrounding slides.
         Returns:
             list[dict]: A list of response dictionaries.
         """
-        async_tasks = []
-        for slide_index, slide_content in enumerate(slides, start=1):
-            async_task = asyncio.create_task(SlideHandler.process_slide(slide_content, slide_index, custom_prompt))
-            async_tasks.append(async_task)
+        async_tasks, summaries = SlideHandler.create_slide_tasks(slides, custom_prompt, deck_context)
         try:
             responses = await asyncio.gather(*async_tasks)
-            return [response for response in responses]
+            return await SlideHandler.add_summary_usage([response for response in responses], summaries)
         except Exception as e:
             print(f"Error in response_handler: {e}")
             return []
+
+    @staticmethod
+    async def batch_response_handler(jobs: list[tuple[list[str], str]], deck_context: list[bool] = None,
+                                     reused: list[dict[int, str]] = None) -> list[list[dict] | None]:
+        """
+        Handles the responses from the OpenAI API for the slides of several files at once.
+        The slides of all the files are requested together, so a batch of small files
+        keeps as many requests in flight as one large file. A failed slide, whose request raised or
+        answered an error after its last attempt, only fails its own file.
+        Args:
+            jobs (list[tuple[list[str], str]]): The slide contents and custom prompt of each file.
+            deck_context (list[bool], optional): True for the files explained in the cross-slide context mode.
+            reused (list[dict[int, str]], optional): The previous explanations of the unchanged slides of each file.
+        Returns:
+            list[list[dict] | None]: The response dictionaries of each file, in the order of the jobs,
+                                     None for the files with a failed slide.
+        """
+        job_tasks = []
+        for (slides, custom_prompt), job_deck_context, job_reused in zip(jobs, deck_context or [False] * len(jobs),
+                                                                         reused or [{}] * len(jobs)):
+            job_tasks.append(SlideHandler.create_slide_tasks(slides, custom_prompt, job_deck_context, job_reused))
+        job_responses = []
+        # The tasks of all the files are already running, the files are only awaited in order
+        for async_tasks, summaries in job_tasks:
+            responses = await asyncio.gather(*async_tasks, return_exceptions=True)
+            errors = [response if isinstance(response, BaseException) else response["error"]
+                      for response in responses if isinstance(response, BaseException) or response.get("error")]
+            if errors:
+                print(f"Error in batch_response_handler: {errors[0]}")
+                job_responses.append(None)
+                continue
+            job_responses.append(await SlideHandler.add_summary_usage(responses, summaries))
+        return job_responses
@@ -1,14 +1,22 @@
+import argparse
 import asyncio
-import tkinter as tk
+import glob
 import os
 import sys
-from tkinter import filedialog
+import time
+from collections import Counter
 from dotenv import load_dotenv
 import read_data
+from api.api_request import ApiRequest
+from api.rate_limiter import RateLimiter
 from api.slide_handler import SlideHandler
 from write_data.output_manage import OutputManage
 
 WINDOWS_PLATFORM = 'win'
+SUPPORTED_EXTENSIONS = ('.pptx', '.pdf')
+OUTPUT_FORMATS = ('json', 'pdf', 'docx', 'txt')
+# The web app writes compressed copies of these formats for its downloads, the command line doesn't need them
+PRECOMPRESSED_FORMATS = ('json', 'txt')
 
 
 def configure():
@@ -26,6 +34,8 @@ def get_user_path() -> str:
     Raises:
         ValueError: If an invalid file type is selected or no file is selected.
     """
+    import tkinter as tk  # Only the file dialog needs tkinter
+    from tkinter import filedialog
     root = tk.Tk()
     root.withdraw()
     file_path = filedialog.askopenfilename(
@@ -42,19 +52,185 @@ def get_user_path() -> str:
         return file_path
 
 
-def main():
+def expand_inputs(inputs: list[str]) -> list[str]:
     """
-    Process PowerPoint presentation (or pdf file).
-    Parse the presentation, extract text from each slide,
-    send it to the OpenAI API for response, and save responses to a PDF file.
+    Expands the command line inputs into the list of files to process.
+    Args:
+        inputs (list[str]): Files, directories (searched recursively) and glob patterns.
+    Returns:
+        list[str]: The .pptx and .pdf files, without duplicates, in the order they were given.
+    Raises:
+        ValueError: If an input doesn't exist.
+    """
+    paths = []
+    for user_input in inputs:
+        if os.path.isdir(user_input):
+            matches = sorted(glob.glob(os.path.join(user_input, '**', '*'), recursive=True))
+        elif glob.has_magic(user_input):
+            matches = sorted(glob.glob(user_input, recursive=True))
+        elif os.path.isfile(user_input):
+            matches = [user_input]
+        else:
+            raise ValueError(f"The input {user_input} does not exist.")
+        paths.extend(path for path in matches
+                     if os.path.isfile(path) and read_data.get_file_type(path) in SUPPORTED_EXTENSIONS)
+    return list(dict.fromkeys(os.path.abspath(path) for path in paths))
+
+
+def get_output_bases(paths: list[str], output_dir: str = "", formats: list[str] = ()) -> dict[str, str]:
+    """
+    Args:
+        paths (list[str]): The paths of the input files.
+        output_dir (str, optional): The folder of the outputs, next to each input file if not specified.
+        formats (list[str], optional): The output formats, an output never replaces one of the input files.
+    Returns:
+        dict[str, str]: The path of the outputs without their format extension, by input path: the input name
+                        without its extension (lecture.v2.pdf -> lecture.v2). Inputs that would share outputs
+                        (e.g. deck.pptx and deck.pdf) or replace an input keep their extension in the name
+                        (deck_pdf), and a number is added when that is not enough (e.g. decks of the same name
+                        in different folders with an output folder).
+    """
+    # Compared without case, the default filesystems of Windows and macOS are case-insensitive
+    inputs = {path.lower() for path in paths}
+
+    def replaces_input(output_base: str) -> bool:
+        return any(f"{output_base}.{file_format}".lower() in inputs for file_format in formats)
+
+    output_bases = {}
+    for path in paths:
+        name, _ = os.path.splitext(os.path.basename(path))
+        output_bases[path] = os.path.join(output_dir or os.path.dirname(path), name)
+    shared = Counter(output_base.lower() for output_base in output_bases.values())
+    taken = set()
+    for path, output_base in output_bases.items():
+        if shared[output_base.lower()] > 1 or replaces_input(output_base):
+            output_base += "_" + read_data.get_file_type(path).lstrip('.')
+        unique_base = output_base
+        index = 2
+        while unique_base.lower() in taken or replaces_input(unique_base):
+            unique_base = f"{output_base}_{index}"
+            index += 1
+        taken.add(unique_base.lower())
+        output_bases[path] = unique_base
+    return output_bases
+
+
+def is_up_to_date(user_path: str, output_base: str, formats: list[str]) -> bool:
+    """
+    Returns:
+        bool: True if every requested output exists and is newer than the input file.
+    """
+    input_time = os.path.getmtime(user_path)
+    return all(os.path.exists(f"{output_base}.{file_format}") and
+               os.path.getmtime(f"{output_base}.{file_format}") >= input_time for file_format in formats)
+
+
+async def process_document(user_path: str, formats: list[str], output_base: str, custom_prompt: str,
+                           semaphore: asyncio.Semaphore, deck_context: bool = False) -> int:
+    """
+    Parses a document, explains its slides and saves the requested output formats.
+    Parsing and rendering run in worker threads, so they don't block the requests of the other documents.
+    Returns:
+        int: The number of slides of the document.
+    Raises:
+        RuntimeError: If a slide could not be explained, no output is written so the document is retried by --resume.
+    """
+    async with semaphore:
+        slides = await asyncio.to_thread(read_data.extract_text, user_path)
+        [responses] = await SlideHandler.batch_response_handler([(slides, custom_prompt)], [deck_context])
+        if responses is None:
+            raise RuntimeError("some slides could not be explained")
+        for file_format in formats:
+            save = getattr(OutputManage, f"save_to_{file_format}")
+            # The full output path, so the writer only replaces the format extension (lecture.v2 -> lecture.v2.pdf)
+            options = {"precompress": False} if file_format in PRECOMPRESSED_FORMATS else {}
+            await asyncio.to_thread(save, responses, f"{output_base}.{file_format}", **options)
+        return len(slides)
+
+
+async def process_documents(paths: list[str], args) -> dict:
+    """
+    Processes the documents concurrently, sharing one connection pool and rate limiter.
+    Returns:
+        dict: The throughput summary.
+    """
+    formats = args.formats
+    output_bases = get_output_bases(paths, args.output_dir, formats)
+    skipped = [path for path in paths if args.resume and is_up_to_date(path, output_bases[path], formats)]
+    pending = [path for path in paths if path not in skipped]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rate_limiter = RateLimiter(args.max_requests, args.requests_per_second)
+    start = time.perf_counter()
+    async with ApiRequest.client(max_connections=args.max_requests or 100, rate_limiter=rate_limiter):
+        results = await asyncio.gather(*(process_document(path, formats, output_bases[path], args.prompt, semaphore,
+                                                          args.deck_context)
+                                         for path in pending), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    slides = 0
+    failed = 0
+    for path, result in zip(pending, results):
+        if isinstance(result, Exception):
+            failed += 1
+            print(f"Failed {path}: {result}", file=sys.stderr)
+        else:
+            slides += result
+            print(f"Saved {path} -> {output_bases[path]}.{{{','.join(formats)}}}")
+    return {"documents": len(paths), "processed": len(pending) - failed, "skipped": len(skipped), "failed": failed,
+            "slides": slides, "seconds": elapsed,
+            "slides_per_second": slides / elapsed if elapsed else 0.0,
+            "documents_per_second": (len(pending) - failed) / elapsed if elapsed else 0.0}
+
+
+def parse_args(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="Explain PowerPoint (.pptx) and pdf files with the OpenAI API. "
+                                                 "Without inputs, a file selection dialog is opened.")
+    parser.add_argument("inputs", nargs="*", help="files, directories or glob patterns to process")
+    parser.add_argument("--formats", default="pdf",
+                        type=lambda value: [file_format.strip().lower() for file_format in value.split(",")],
+                        help=f"comma separated output formats: {', '.join(OUTPUT_FORMATS)} (default pdf)")
+    parser.add_argument("--concurrency", type=int, default=4, help="documents processed at once (default 4)")
+    parser.add_argument("--max-requests", type=int, default=0, help="API requests in flight at once, 0 for no limit")
+    parser.add_argument("--requests-per-second", type=float, default=0.0,
+                        help="API requests started per second, 0 for no limit")
+    parser.add_argument("--resume", action="store_true", help="skip inputs whose outputs are up to date")
+    parser.add_argument("--output-dir", default="", help="folder of the outputs (default next to each input)")
+    parser.add_argument("--prompt", default="", help="custom prompt for the explanations")
+    parser.add_argument("--deck-context", action="store_true",
+                        help="explain each slide with an outline of the surrounding slides (summaries first)")
+    args = parser.parse_args(argv)
+    unknown_formats = set(args.formats) - set(OUTPUT_FORMATS)
+    if unknown_formats:
+        parser.error(f"unknown output formats: {', '.join(sorted(unknown_formats))}")
+    if args.concurrency < 1:
+        parser.error("--concurrency must be at least 1")
+    return args
+
+
+def main(argv: list[str] = None):
+    """
+    Process PowerPoint presentations (or pdf files).
+    Parse each presentation, extract text from each slide,
+    send it to the OpenAI API for response, and save responses to the requested formats (PDF by default).
+    Without inputs on the command line, a single file is selected with a file dialog.
     """
     configure()
-    user_path = get_user_path()
-    slides = read_data.extract_text(user_path)
-    loop = asyncio.get_event_loop()
-    responses = loop.run_until_complete(SlideHandler.response_handler(slides))
-    output_file = OutputManage.save_to_pdf(responses, user_path)
-    print(f"Saving the output file in {output_file}")
+    args = parse_args(argv)
+    if not args.inputs:
+        user_path = get_user_path()
+        slides = read_data.extract_text(user_path)
+        loop = asyncio.get_event_loop()
+        responses = loop.run_until_complete(SlideHandler.response_handler(slides, args.prompt, args.deck_context))
+        output_base = get_output_bases([user_path], formats=['pdf'])[user_path]
+        output_file = OutputManage.save_to_pdf(responses, f"{output_base}.pdf")
+        print(f"Saving the output file in {output_file}")
+        return
+    paths = expand_inputs(args.inputs)
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+    summary = asyncio.run(process_documents(paths, args))
+    print(f"{summary['processed']} processed, {summary['skipped']} skipped, {summary['failed']} failed "
+          f"of {summary['documents']} documents: {summary['slides']} slides in {summary['seconds']:.1f}s "
+          f"({summary['slides_per_second']:.2f} slides/s, {summary['documents_per_second']:.2f} documents/s)")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,73 @@
+"""
+corpus.py
+
+Generates synthetic pptx and pdf documents of a given number of slides for the benchmarks.
+"""
+import os
+import random
+
+WORDS = ("latency throughput model slide lecture explain network queue memory cache request response "
+         "parser pipeline token budget server client upload output render student course chapter").split()
+
+
+def slide_text(rng: random.Random, words: int = 60) -> tuple[str, str]:
+    """
+    Returns:
+        tuple[str, str]: A random title and body text.
+    """
+    title = " ".join(rng.choice(WORDS) for _ in range(4)).capitalize()
+    body = " ".join(rng.choice(WORDS) for _ in range(words))
+    return title, body
+
+
+def make_pptx(path: str, slides: int, seed: int = 0) -> str:
+    from pptx import Presentation
+    from pptx.util import Inches
+    rng = random.Random(seed)
+    presentation = Presentation()
+    for _ in range(slides):
+        title, body = slide_text(rng)
+        slide = presentation.slides.add_slide(presentation.slide_layouts[1])
+        slide.shapes.title.text = title
+        slide.placeholders[1].text = body
+        slide.shapes.add_textbox(Inches(1), Inches(6.5), Inches(8), Inches(0.5)).text = "Footer note"
+    presentation.save(path)
+    return path
+
+
+def make_pdf(path: str, slides: int, seed: int = 0) -> str:
+    from fpdf import FPDF
+    rng = random.Random(seed)
+    pdf = FPDF('P', 'mm', 'Letter')
+    pdf.set_font("helvetica", size=12)
+    for _ in range(slides):
+        title, body = slide_text(rng)
+        pdf.add_page()
+        pdf.multi_cell(0, 10, txt=title, ln=1)
+        pdf.multi_cell(0, 8, txt=body, ln=1)
+    pdf.output(path)
+    return path
+
+
+def make_corpus(folder: str, sizes: list[int], files_per_size: int = 1, formats: tuple = ("pptx", "pdf"),
+                seed: int = 0) -> list[tuple[str, int]]:
+    """
+    Generates files_per_size documents of every size and format.
+    Args:
+        folder (str): The folder to write the documents to.
+        sizes (list[int]): The slide counts of the documents.
+        files_per_size (int): The number of documents of each size and format.
+        formats (tuple): The formats to generate, pptx and/or pdf.
+        seed (int): The seed of the random text.
+    Returns:
+        list[tuple[str, int]]: The path and slide count of each document.
+    """
+    os.makedirs(folder, exist_ok=True)
+    documents = []
+    for size in sizes:
+        for index in range(files_per_size):
+            for file_format in formats:
+                path = os.path.join(folder, f"deck_{size}_{index}.{file_format}")
+                maker = make_pptx if file_format == "pptx" else make_pdf
+                documents.append((maker(path, size, seed=seed + size * 1000 + index), size))
+    return documents
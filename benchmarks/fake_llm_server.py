@@ -0,0 +1,156 @@
+"""
+fake_llm_server.py
+
+A local OpenAI compatible chat completions server for benchmarks and load tests.
+Every request waits a configurable latency (with jitter) and can be rejected with a 429,
+or answered with an HTML 502 page like a failing reverse proxy, at configurable rates,
+so the pipeline can be measured without calling the real API.
+
+Run it on its own with:
+    python -m benchmarks.fake_llm_server --port 8099 --latency 0.5 --jitter 0.1 --rate-429 0.05
+and point the app to it with API_BASE_URL="http://127.0.0.1:8099/v1".
+"""
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+from aiohttp import web
+
+
+class FakeLLMServer:
+    """
+    An OpenAI compatible server answering POST /v1/chat/completions.
+    Attributes:
+        latency (float): The mean response latency in seconds.
+        jitter (float): The maximum deviation from the mean latency in seconds.
+        rate_429 (float): The fraction of requests rejected with HTTP 429.
+        rate_502 (float): The fraction of requests answered with an HTML 502 page instead of JSON.
+        max_concurrency (int): Requests above this number of in-flight requests are rejected with 429, 0 for no limit.
+        requests (int): The number of requests received.
+        rejected (int): The number of requests rejected with 429.
+        peak_in_flight (int): The highest number of requests in flight at once.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.2, jitter: float = 0.05,
+                 rate_429: float = 0.0, max_concurrency: int = 0, seed: int = 0, rate_502: float = 0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_502 = rate_502
+        self.max_concurrency = max_concurrency
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.loop = None
+        self.runner = None
+        self.thread = None
+        self.started = threading.Event()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    async def chat_completions(self, request: web.Request) -> web.Response:
+        body = await request.json()
+        with self.lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            overloaded = self.max_concurrency and self.in_flight > self.max_concurrency
+            rejected = overloaded or self.random.random() < self.rate_429
+            bad_gateway = not rejected and self.random.random() < self.rate_502
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        try:
+            if rejected:
+                with self.lock:
+                    self.rejected += 1
+                return web.json_response({"error": {"message": "Rate limit reached", "type": "requests",
+                                                    "code": "rate_limit_exceeded"}}, status=429)
+            if bad_gateway:
+                return web.Response(text="<html><body><h1>502 Bad Gateway</h1></body></html>", status=502,
+                                    content_type="text/html")
+            await asyncio.sleep(delay)
+            prompt = body["messages"][-1]["content"]
+            content = f"Explanation of {len(prompt)} characters: " + prompt[:200]
+            prompt_tokens = len(prompt) // 4
+            completion_tokens = min(body.get("max_tokens", 512), len(content) // 4)
+            return web.json_response({
+                "id": f"chatcmpl-fake-{self.requests}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content},
+                             "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens}
+            })
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        return app
+
+    async def start_site(self):
+        self.runner = web.AppRunner(self.create_app())
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    def run(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.start_site())
+        self.started.set()
+        self.loop.run_forever()
+        self.loop.run_until_complete(self.runner.cleanup())
+        self.loop.close()
+
+    def start(self) -> "FakeLLMServer":
+        """
+        Starts the server in a background thread and waits until it listens.
+        Returns:
+            FakeLLMServer: The started server.
+        """
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        self.started.wait()
+        return self
+
+    def stop(self):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"requests": self.requests, "rejected": self.rejected, "peak_in_flight": self.peak_in_flight}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local fake OpenAI compatible server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.2, help="mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="maximum latency deviation in seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests rejected with 429")
+    parser.add_argument("--rate-502", type=float, default=0.0, help="fraction of requests answered with HTML 502")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="reject requests above this many in flight")
+    args = parser.parse_args()
+    server = FakeLLMServer(args.host, args.port, args.latency, args.jitter, args.rate_429, args.max_concurrency,
+                           rate_502=args.rate_502)
+    web.run_app(server.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
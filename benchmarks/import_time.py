@@ -0,0 +1,78 @@
+"""
+import_time.py
+
+Measures the startup import time of the web app and the CLI in fresh interpreters, and checks that
+the heavy optional dependencies (renderers, parsers, the API client and the GUI) are not imported at startup.
+
+    python -m benchmarks.import_time --runs 5 --output import_time.json
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Median import time targets in seconds, measured on a developer laptop
+IMPORT_TARGETS = {"flask_app": 0.8, "app_engine": 0.3}
+# Modules that must only be imported when a format, parser or the API is first used
+LAZY_MODULES = ("fpdf", "docx", "bidi", "pptx", "PyPDF2", "json2html", "tkinter", "aiohttp", "openai", "brotli")
+
+MEASURE_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"seconds": elapsed, "loaded": [m for m in {lazy_modules!r} if m in sys.modules]}}))
+"""
+
+
+def measure_import(module: str) -> dict:
+    """
+    Imports a module in a fresh interpreter.
+    Args:
+        module (str): The module to import.
+    Returns:
+        dict: The import time in seconds and the lazy modules that were loaded by the import.
+    """
+    script = MEASURE_SCRIPT.format(module=module, lazy_modules=LAZY_MODULES)
+    result = subprocess.run([sys.executable, "-c", script], cwd=REPO_ROOT, capture_output=True, text=True,
+                            check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def measure(runs: int = 5) -> dict:
+    """
+    Returns:
+        dict: The median, minimum and target import time of each module, the lazy modules it loaded,
+              and whether it passed.
+    """
+    results = {}
+    for module, target in IMPORT_TARGETS.items():
+        samples = [measure_import(module) for _ in range(runs)]
+        median = statistics.median(sample["seconds"] for sample in samples)
+        loaded = sorted({name for sample in samples for name in sample["loaded"]})
+        results[module] = {"median_seconds": round(median, 4),
+                           "min_seconds": round(min(sample["seconds"] for sample in samples), 4),
+                           "target_seconds": target, "lazy_modules_loaded": loaded,
+                           "passed": median <= target and not loaded}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Startup import time of the web app and the CLI")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output", default="", help="write the JSON results to this file")
+    args = parser.parse_args()
+    results = measure(args.runs)
+    text = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(text)
+    print(text)
+    sys.exit(0 if all(result["passed"] for result in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,240 @@
+"""
+run_benchmark.py
+
+End-to-end benchmark of the explainer pipeline. It generates a synthetic pptx/pdf corpus,
+uploads it through the web app, runs the real explainer system against a local fake
+OpenAI compatible server, and reports slides/sec, job latency percentiles, peak RSS and
+API calls per job as JSON, so runs can be compared with --baseline.
+
+Example:
+    python -m benchmarks.run_benchmark --sizes 5,20,50 --files-per-size 2 --latency 0.3 --rate-429 0.02 \
+        --output bench.json --baseline previous_bench.json
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.corpus import make_corpus
+from benchmarks.fake_llm_server import FakeLLMServer
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# The metrics compared with --baseline, and whether a higher value is better
+COMPARED_METRICS = {"slides_per_second": True, "job_latency_p50": False, "job_latency_p95": False,
+                    "peak_rss_mb": False, "api_calls_per_job": False}
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, capture_output=True,
+                              text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ""
+
+
+def upload_corpus(client, documents: list[tuple[str, int]], batch: bool, deck_context: bool = False) -> list[str]:
+    """
+    Uploads the documents through the web app.
+    Returns:
+        list[str]: The uids of the uploads.
+    """
+    if batch:
+        files = []
+        for path, _ in documents:
+            with open(path, 'rb') as file:
+                files.append((io.BytesIO(file.read()), os.path.basename(path)))
+        response = client.post('/upload/batch', data={'files': files, 'email': 'bench@example.com',
+                                                      'deck_context': '1' if deck_context else ''})
+        return response.get_json()['uids']
+    uids = []
+    for path, _ in documents:
+        with open(path, 'rb') as file:
+            response = client.post('/upload', data={'file': (file, os.path.basename(path)),
+                                                    'email': 'bench@example.com',
+                                                    'deck_context': '1' if deck_context else ''})
+        uids.append(response.get_json()['uid'])
+    return uids
+
+
+def run(args) -> dict:
+    """
+    Runs the benchmark in a temporary working directory.
+    Returns:
+        dict: The benchmark configuration and results.
+    """
+    work_dir = tempfile.mkdtemp(prefix="explainer-bench-")
+    sizes = [int(size) for size in args.sizes.split(",")]
+    formats = tuple(args.formats.split(","))
+    documents = make_corpus(os.path.join(work_dir, "corpus"), sizes, args.files_per_size, formats, args.seed)
+    server = None
+    if args.server_url:
+        os.environ["API_BASE_URL"] = args.server_url
+    else:
+        server = FakeLLMServer(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+                               max_concurrency=args.server_max_concurrency, seed=args.seed).start()
+        os.environ["API_BASE_URL"] = server.base_url
+    os.environ.setdefault("API_KEY", "benchmark")
+    os.environ["EXPLAINER_WORKERS"] = str(args.workers)
+    os.environ["MAX_JOBS_PER_USER"] = str(args.workers)
+    os.environ["ADAPTIVE_CONCURRENCY"] = "1" if args.adaptive else "0"
+    # The app keeps its database, uploads and outputs relative to the working directory
+    os.chdir(work_dir)
+    sys.argv = sys.argv[:1]
+    from flask_app import app, setup_app
+    from flask_imp.db_model import Session, Upload
+    from flask_imp.flask_explainer import explainer_system
+    from flask_imp.flask_util import status_done, status_pending
+    from api.adaptive_limiter import concurrency_limiter
+    from monitoring.metrics import API_REQUESTS
+
+    setup_app()
+    uids = upload_corpus(app.test_client(), documents, args.batch, args.deck_context)
+    stop_event = threading.Event()
+    explainer = threading.Thread(target=explainer_system, args=(stop_event,))
+    start = time.perf_counter()
+    explainer.start()
+    deadline = start + args.timeout
+    finished = []
+    # The adaptive limit over time, to see it converge
+    concurrency_samples = []
+    while time.perf_counter() < deadline:
+        with Session() as session:
+            finished = session.query(Upload).filter(Upload.uid.in_(uids), Upload.status != status_pending).all()
+            if len(finished) == len(uids):
+                break
+        if args.adaptive:
+            limiter_stats = concurrency_limiter.stats()
+            concurrency_samples.append([round(time.perf_counter() - start, 2), limiter_stats["limit"],
+                                        limiter_stats["in_flight"]])
+        time.sleep(0.1)
+    wall_seconds = time.perf_counter() - start
+    stop_event.set()
+    explainer.join()
+    with Session() as session:
+        uploads = session.query(Upload).filter(Upload.uid.in_(uids)).all()
+        latencies = [(upload.finish_time - upload.upload_time).total_seconds() for upload in uploads
+                     if upload.status == status_done]
+        timings = [json.loads(upload.timings) for upload in uploads if upload.timings]
+    if server is not None:
+        server_stats = server.stats()
+        server.stop()
+    else:
+        server_stats = {"requests": sum(API_REQUESTS.samples().values())}
+    total_slides = sum(size for _, size in documents)
+    api_statuses = {status[0]: count for status, count in API_REQUESTS.samples().items()}
+    return {
+        "benchmark": "explainer_pipeline",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "git_commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "config": {"sizes": sizes, "files_per_size": args.files_per_size, "formats": list(formats),
+                   "batch": args.batch, "workers": args.workers, "latency": args.latency, "jitter": args.jitter,
+                   "rate_429": args.rate_429, "server_max_concurrency": args.server_max_concurrency,
+                   "server_url": args.server_url or "local", "adaptive": args.adaptive,
+                   "deck_context": args.deck_context},
+        "results": {
+            "jobs": len(uids),
+            "jobs_done": len(latencies),
+            "slides": total_slides,
+            "wall_seconds": round(wall_seconds, 3),
+            "slides_per_second": round(total_slides / wall_seconds, 3) if wall_seconds else 0.0,
+            "job_latency_p50": round(percentile(latencies, 0.5), 3),
+            "job_latency_p95": round(percentile(latencies, 0.95), 3),
+            "job_latency_p99": round(percentile(latencies, 0.99), 3),
+            "job_latency_max": round(max(latencies, default=0.0), 3),
+            "parse_seconds_total": round(sum(timing.get("parse_seconds", 0) for timing in timings), 3),
+            "peak_rss_mb": round(peak_rss_mb(), 1),
+            "api_calls": server_stats["requests"],
+            "api_calls_per_job": round(server_stats["requests"] / len(uids), 2) if uids else 0.0,
+            "api_statuses": api_statuses,
+            "server": server_stats,
+            "tokens": sum(timing.get("prompt_tokens", 0) + timing.get("completion_tokens", 0) for timing in timings),
+            "summary_tokens": sum(timing.get("summary_tokens", 0) for timing in timings),
+            "context_tokens": sum(timing.get("context_tokens", 0) for timing in timings),
+            "concurrency": {"final": concurrency_limiter.stats(), "samples": concurrency_samples} if args.adaptive
+            else None
+        }
+    }
+
+
+def compare(result: dict, baseline: dict) -> list[str]:
+    """
+    Compares the main metrics of two benchmark results.
+    Returns:
+        list[str]: A line per metric with both values, the relative change and whether it regressed.
+    """
+    lines = []
+    for metric, higher_is_better in COMPARED_METRICS.items():
+        current = result["results"].get(metric, 0.0)
+        previous = baseline["results"].get(metric, 0.0)
+        change = (current - previous) / previous * 100 if previous else 0.0
+        regressed = change < 0 if higher_is_better else change > 0
+        lines.append(f"{metric:20} {previous:>10} -> {current:>10} ({change:+.1f}%)"
+                     f"{' regression' if regressed and abs(change) > 5 else ''}")
+    return lines
+
+
+def parse_args(argv: list[str] = None):
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the explainer pipeline")
+    parser.add_argument("--sizes", default="5,20,50", help="comma separated slide counts of the generated decks")
+    parser.add_argument("--files-per-size", type=int, default=1, help="decks generated of every size and format")
+    parser.add_argument("--formats", default="pptx,pdf", help="comma separated formats: pptx, pdf")
+    parser.add_argument("--batch", action="store_true", help="upload the corpus as a single batch")
+    parser.add_argument("--workers", type=int, default=1, help="EXPLAINER_WORKERS of the explainer system")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake server mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="fake server latency jitter in seconds")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="fraction of requests rejected with 429")
+    parser.add_argument("--server-max-concurrency", type=int, default=0,
+                        help="fake server rejects requests above this many in flight with 429")
+    parser.add_argument("--deck-context", action="store_true", help="upload the corpus in the cross-slide context mode")
+    parser.add_argument("--adaptive", action="store_true", help="enable the adaptive concurrency limiter")
+    parser.add_argument("--server-url", default="", help="use a running server instead of the local fake server")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for the jobs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="", help="write the JSON results to this file")
+    parser.add_argument("--baseline", default="", help="compare with the JSON results of a previous run")
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] = None):
+    args = parse_args(argv)
+    # run() changes the working directory, resolve the paths first
+    output = os.path.abspath(args.output) if args.output else ""
+    baseline = os.path.abspath(args.baseline) if args.baseline else ""
+    sys.path.insert(0, REPO_ROOT)
+    result = run(args)
+    text = json.dumps(result, indent=4)
+    if output:
+        with open(output, 'w') as file:
+            file.write(text)
+    print(text)
+    if baseline:
+        with open(baseline, 'r') as file:
+            print("\n".join(compare(result, json.load(file))))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,24 @@
 import os
 import sys
 import threading
-from json2html import json2html
+import zipfile
 
 from dotenv import load_dotenv
-from flask import Flask, Response, request, jsonify, send_file
+from flask import Flask, Response, request, jsonify
 from flask import render_template, redirect, flash, url_for, send_from_directory, make_response
 
 from flask_imp.db_model import Session, User, Upload, create_all
+from flask_imp.flask_download import send_output, DOWNLOAD_TYPES, SENDFILE_X_SENDFILE
 from flask_imp.flask_explainer import explainer_system, setup_explainer
-from flask_imp.flask_util import set_path, load_json_file, save_to_json, get_output_path
-from flask_imp.flask_util import status_done, save_upload, save_upload_with_user
+from flask_imp.flask_retention import retention, retention_system, setup_retention
+from flask_imp.flask_scheduler import scheduler
+from api.adaptive_limiter import concurrency_limiter
+from flask_imp.result_store import ResultStore
+from flask_imp.search_index import SearchIndex
+from monitoring.metrics import REGISTRY, OUTPUT_CACHE
+from flask_imp.flask_util import set_path, load_json_file, save_to_json, get_output_path, output_file_path
+from flask_imp.flask_util import touch_upload, status_failed
+from flask_imp.flask_util import status_done, save_upload, save_upload_with_user, save_batch, get_batch_progress
 
 app = Flask(__name__)
 
@@ -23,15 +31,22 @@ def setup_app():
     load_dotenv()
     app.secret_key = os.getenv("SECRET_KEY")
     set_path()
-    app.config['MAX_CONTENT_LENGTH'] = 16 * 1000 * 1000  # Sets the maximum content length to 16 megabytes
+    # Sets the maximum content length, 16 megabytes by default (batch uploads may need a higher limit)
+    app.config['MAX_CONTENT_LENGTH'] = int(os.getenv("MAX_CONTENT_LENGTH_MB", "16")) * 1000 * 1000
     app.config['JSONIFY_PRETTYPRINT_REGULAR'] = True  # Enable pretty-printing for JSON responses
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///db/db.sqlite3'  # Set SQLite database URI
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False  # Disable modification tracking
+    # Let the reverse proxy send the output files ("x-sendfile" or "x-accel"), empty to send them from Flask
+    app.config['SENDFILE_MODE'] = os.getenv("SENDFILE_MODE", "").lower()
+    app.config['USE_X_SENDFILE'] = app.config['SENDFILE_MODE'] == SENDFILE_X_SENDFILE
+    app.config['X_ACCEL_PREFIX'] = os.getenv("X_ACCEL_PREFIX", "/outputs/")  # nginx internal location of outputs
     # Enable testing mode if 'test' is provided as a command-line argument
     if len(sys.argv) > 1 and str(sys.argv[1]).lower() == "test":
         app.config['TESTING'] = True
     create_all()
+    SearchIndex.create()
     setup_explainer()
+    setup_retention()
 
 
 @app.route('/static/<filename>')
@@ -86,14 +101,62 @@ def upload():
             return redirect(request.url)
         email = request.form.get('email')
         prompt = request.form.get('prompt', '')
+        deck_context = get_form_flag('deck_context')
         if email:
-            uid = save_upload_with_user(file, email, prompt)
+            uid = save_upload_with_user(file, email, prompt, deck_context)
         else:
-            uid = save_upload(file, prompt)
+            uid = save_upload(file, prompt, deck_context)
         return jsonify({'uid': uid}), 200
     return render_template("upload.html")
 
 
+def get_form_flag(name: str) -> bool:
+    """
+    Args:
+        name (str): The name of a form field, e.g. a checkbox.
+    Returns:
+        bool: True if the field is checked ("on", "1" or "true").
+    """
+    return request.form.get(name, '').lower() in ('on', '1', 'true')
+
+
+@app.route('/upload/batch', methods=['POST'])
+def upload_batch():
+    """
+    Handles batch upload functionality.
+    Accepts many files (and zip archives of pptx and pdf files) in the 'files' field of a single
+    POST request, saves all of them in one transaction and returns the batch UID with the UIDs
+    of its uploads. The uploads of a batch are explained together by the explainer system.
+    Returns:
+        Response: JSON response with the batch UID and upload UIDs, or an error with HTTP status code 400.
+    """
+    files = [file for file in request.files.getlist('files') + request.files.getlist('file') if file.filename]
+    if not files:
+        return jsonify({'error': 'No file selected'}), 400
+    try:
+        batch_uid, uids = save_batch(files, request.form.get('email'), request.form.get('prompt', ''),
+                                     get_form_flag('deck_context'))
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'batch_uid': batch_uid, 'uids': uids}), 200
+
+
+@app.route('/batch/<batch_uid>', methods=['GET'])
+def batch_status(batch_uid):
+    """
+    Retrieves the aggregate progress of the batch with the given UID,
+    including the status of each of its uploads.
+    Args:
+        batch_uid (str): The UID of the batch.
+    Returns:
+        Response: JSON response with the batch progress, or a 'not found' JSON response.
+    """
+    progress = get_batch_progress(batch_uid)
+    if progress is None:
+        return jsonify({'status': 'not found'}), 404
+    return jsonify(progress), 200
+
+
 @app.route('/status/<uid>', methods=['GET'])
 def status_get(uid):
     """
@@ -111,16 +174,93 @@ def status_get(uid):
             if file_data.status == status_done:
                 output = load_json_file(f"{uid}.json")
                 status_info = save_to_json(uid, file_data.status, file_data.filename, file_data.finish_time, output)
+                touch_upload(uid)
             else:
                 status_info = save_to_json(uid, file_data.status, file_data.filename, file_data.finish_time)
             if app.config.get('TESTING'):
                 return jsonify(status_info), 200
             else:
+                from json2html import json2html
                 status_info = json2html.convert(json=status_info)
                 return render_template("status.html", status_info=status_info)
     return jsonify({'status': 'not found'}), 404
 
 
+@app.route('/status/<uid>/slides', methods=['GET'])
+def status_slides(uid):
+    """
+    Retrieves a range of the explained slides of the file with the given UID.
+    The 'from' and 'to' query parameters select the first and last slide numbers (included);
+    without them all the slides are returned.
+    Args:
+        uid (str): The UID of the file.
+    Returns:
+        Response: JSON response with the status, the slide count and the slides of the range,
+                  or a 'not found' JSON response.
+    """
+    first = request.args.get('from', 1, type=int)
+    last = request.args.get('to', None, type=int)
+    with Session() as session:
+        file_data = session.query(Upload).filter_by(uid=uid).first()
+        if not file_data:
+            return jsonify({'status': 'not found'}), 404
+        status = file_data.status
+    touch_upload(uid)
+    return jsonify({'uid': uid, 'status': status, 'count': ResultStore.count(uid),
+                    'slides': ResultStore.get_slides(uid, max(first, 1), last)}), 200
+
+
+@app.route('/status/<uid>/slides/<int:slide_number>', methods=['GET'])
+def status_slide(uid, slide_number):
+    """
+    Retrieves a single explained slide of the file with the given UID.
+    Args:
+        uid (str): The UID of the file.
+        slide_number (int): The 1-based number of the slide.
+    Returns:
+        Response: JSON response with the slide number and content, or a 'not found' JSON response.
+    """
+    slide = ResultStore.get_slide(uid, slide_number)
+    if slide is None:
+        return jsonify({'status': 'not found'}), 404
+    touch_upload(uid)
+    return jsonify(slide), 200
+
+
+def resolve_output(uid: str, file_type: str) -> tuple[str, str]:
+    """
+    Finds the output file of the given UID and type, rendering it if needed.
+    The database is only queried when the output file does not exist yet,
+    so repeated downloads are served straight from the outputs folder.
+    Args:
+        uid (str): The UID of the file.
+        file_type (str): The requested output type (txt, pdf, docx or json).
+    Returns:
+        tuple[str, str]: The output path, or an empty path and the reason it is not available.
+    """
+    if file_type not in DOWNLOAD_TYPES:
+        return "", f"Unsupported file type: {file_type}"
+    output_path = output_file_path(f"{uid}.{file_type}")
+    if os.path.exists(output_path):
+        OUTPUT_CACHE.inc(result="hit")
+        touch_upload(uid)
+        return output_path, ""
+    with Session() as session:
+        file_data = session.query(Upload).filter_by(uid=uid).first()
+        if not file_data:
+            return "", "status uid is not exist"
+        if file_data.status == status_failed:
+            return "", "The file could not be explained"
+        if file_data.status != status_done:
+            return "", "The file is not ready yet"
+    OUTPUT_CACHE.inc(result="miss")
+    output_path = get_output_path(f"{uid}.{file_type}")
+    if output_path == "":
+        return "", "The output file is not available"
+    touch_upload(uid)
+    return output_path, ""
+
+
 @app.route('/status/<uid>', methods=['POST'])
 def status_post(uid):
     """
@@ -132,20 +272,72 @@ def status_post(uid):
     Returns:
         Response: File download response or redirection with feedback.
     """
-    with Session() as session:
-        file_data = session.query(Upload).filter_by(uid=uid).first()
-        if file_data:
-            if file_data.status == status_done:
-                file_path = get_output_path(f"{uid}.{request.form.get('file_type')}")
-                if file_path != "":
-                    return send_file(file_path, as_attachment=True)
-            else:
-                flash("The file is not ready yet")
-        else:
-            flash("status uid is not exist")
+    output_path, error = resolve_output(uid, request.form.get('file_type'))
+    if output_path:
+        return send_output(output_path)
+    flash(error)
     return redirect(request.url)
 
 
+@app.route('/download/<uid>/<file_type>', methods=['GET'])
+def download(uid, file_type):
+    """
+    Downloads the output file of the given UID in the requested format.
+    Supports conditional requests (ETag / Last-Modified), HTTP Range, pre-compressed
+    txt and json variants and sendfile offloading to a reverse proxy.
+    Args:
+        uid (str): The UID of the file.
+        file_type (str): The requested output type (txt, pdf, docx or json).
+    Returns:
+        Response: File download response, or a 'not found' JSON response with the reason.
+    """
+    output_path, error = resolve_output(uid, file_type)
+    if output_path:
+        return send_output(output_path)
+    return jsonify({'status': 'not found', 'error': error}), 404
+
+
+@app.route('/queue', methods=['GET'])
+def queue_stats():
+    """
+    Retrieves the state of the explainer scheduler: its settings, the number of running jobs,
+    and the queue depth and wait time of each job class (priority, small and large),
+    with the state of the adaptive concurrency limiter of the API requests.
+    Returns:
+        Response: JSON response with the scheduler state.
+    """
+    return jsonify(dict(scheduler.stats(), concurrency=concurrency_limiter.stats())), 200
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    Exposes the metrics of the web app and the explainer system (parse, API, job and render times,
+    API status codes and tokens, queue depth and output cache hits) in the Prometheus text format.
+    Returns:
+        Response: The metrics as plain text.
+    """
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+
+@app.route('/search/results', methods=['GET'])
+def search_results():
+    """
+    Full-text search over the filenames, prompts and slide explanations of the uploads, best matches first.
+    Query parameters: 'q' the words to search for (the last one as a prefix), 'page' and 'per_page'
+    for the pagination, and an optional 'email' to only search the uploads of a user.
+    Returns:
+        Response: JSON response with the total number of matches and the matches of the page,
+                  or an error with HTTP status code 400 when 'q' is missing.
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'No search query'}), 400
+    return jsonify(SearchIndex.search(query, request.args.get('page', 1, type=int),
+                                      request.args.get('per_page', 20, type=int),
+                                      request.args.get('email') or None)), 200
+
+
 @app.route('/search', methods=['POST', 'GET'])
 def search():
     """
@@ -182,17 +374,21 @@ def search():
 def main():
     """
     Entry point of the application. Sets up the Flask app,
-    starts the explainer system in a separate thread,
+    starts the explainer system (and the retention service, when enabled) in separate threads,
     runs the Flask app, and waits for the app to complete.
-    Finally, raises the stop event to terminate the explainer system thread.
+    Finally, raises the stop event to terminate the background threads.
     """
     setup_app()
     stop_event = threading.Event()
-    t1 = threading.Thread(target=explainer_system, args=(stop_event,))
-    t1.start()
+    threads = [threading.Thread(target=explainer_system, args=(stop_event,))]
+    if retention.enabled:
+        threads.append(threading.Thread(target=retention_system, args=(stop_event,)))
+    for thread in threads:
+        thread.start()
     app.run(debug=True)
     stop_event.set()
-    t1.join()
+    for thread in threads:
+        thread.join()
 
 
 if __name__ == '__main__':
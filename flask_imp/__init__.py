@@ -1,5 +1,8 @@
 from . import flask_explainer
 from . import db_model
 from . import flask_util
+from . import flask_download
+from . import flask_retention
+from . import search_index
 
-__all__ = ['db_model', 'flask_util', 'flask_explainer']
+__all__ = ['db_model', 'flask_util', 'flask_explainer', 'flask_download', 'flask_retention', 'search_index']
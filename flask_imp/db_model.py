@@ -1,8 +1,8 @@
 from typing import List, Optional
 from uuid import uuid4
 
-from sqlalchemy import Enum, ForeignKey, String, DateTime
-from sqlalchemy import create_engine
+from sqlalchemy import Enum, ForeignKey, String, DateTime, Integer, Text, LargeBinary, UniqueConstraint, Boolean
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship, sessionmaker, scoped_session, declarative_base
 
 # Create the engine
@@ -18,6 +18,7 @@ Base = declarative_base()
 class UploadStatus:
     done = "done"
     pending = "pending"
+    failed = "failed"
 
 
 def generate_uid() -> str:
@@ -36,14 +37,63 @@ class User(Base):
     Attributes:
         id (int): The primary key for the User table.
         email (str): The email address of the user.
+        priority (int): The scheduling priority of the user, higher values (e.g. paid tiers) are served first.
         uploads (List[Upload]): A list of uploads associated with the user.
     """
     __tablename__ = "user"
     id: Mapped[int] = mapped_column(primary_key=True)
     email: Mapped[str] = mapped_column(String(128), unique=True, nullable=False)
+    priority: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
     uploads: Mapped[List["Upload"]] = relationship("Upload", backref='user', lazy=True, cascade='all, delete-orphan')
 
 
+class Batch(Base):
+    """
+    Represents a Batch entity in the database, a group of uploads received in a single request.
+    Attributes:
+        id (int): The primary key for the Batch table.
+        uid (str): The unique identifier for the batch.
+        upload_time (DateTime): The timestamp of when the Web API received the batch.
+        user_id (Optional[int]): The foreign key referencing the User table, indicating the user who uploaded the batch.
+        uploads (List[Upload]): A list of uploads that belong to the batch.
+    """
+    __tablename__ = "batch"
+    id: Mapped[int] = mapped_column(primary_key=True)
+    uid: Mapped[str] = mapped_column(String(36), default=generate_uid, nullable=False, unique=True)
+    upload_time: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
+    user_id: Mapped[Optional[int]] = mapped_column(ForeignKey('user.id'))
+    uploads: Mapped[List["Upload"]] = relationship("Upload", backref='batch', lazy=True, cascade='all, delete-orphan')
+
+    @classmethod
+    def delete_by_uid(cls, uid: str, session: Session = None):
+        """
+        Deletes an instance of Batch by UID, together with its uploads and their files, see
+        flask_retention.delete_uploads().
+
+        Args:
+            uid (str): The UID of the Batch to be deleted.
+            session (Session, optional): The SQLAlchemy session. If not provided, a new session will be created.
+
+        Raises:
+            sqlalchemy.orm.exc.NoResultFound: If no batch with the specified UID is found.
+        """
+        if session is None:
+            session = Session()
+
+        try:
+            from flask_imp.flask_retention import delete_uploads
+            batch = session.query(cls).filter_by(uid=uid).one()
+            delete_uploads(session, list(batch.uploads))
+            # delete_uploads() deletes the emptied batch, unless it had no uploads
+            session.query(cls).filter_by(uid=uid).delete()
+            session.commit()
+        except Exception as e:
+            session.rollback()
+            raise e
+        finally:
+            session.close()
+
+
 class Upload(Base):
     """
     Represents an Upload entity in the database.
@@ -53,9 +103,19 @@ class Upload(Base):
         filename (str): The original filename of the uploaded file.
         upload_time (DateTime): The timestamp of when the Web API received the upload.
         finish_time (Optional[DateTime]): The timestamp of when the Explainer finished processing the upload.
-        status (str): The current status of the upload (either 'pending' or 'done').
+        status (str): The current status of the upload ('pending', 'done', or 'failed' when it couldn't be explained).
         user_id (Optional[int]): The foreign key referencing the User table, indicating the user who uploaded this upload.
         prompt (Optional[str]): Free text prompt associated with the upload.
+        batch_id (Optional[int]): The foreign key referencing the Batch table, when the upload is part of a batch.
+        slide_count (Optional[int]): The number of slides (or pages) of the file, counted by the explainer scheduler.
+        timings (Optional[str]): JSON breakdown of the processing time of the upload (parse, API, persist, total),
+                                 with its slide and token counts.
+        last_access (Optional[DateTime]): The last time the result of the upload was read, for the LRU retention.
+        storage_bytes (int): The size of the uploaded file and of the outputs rendered from it.
+        deck_context (bool): True to explain the slides with the outline of the surrounding slides.
+        parent_id (Optional[int]): The previous upload of the same file by the same user, whose unchanged
+                                   slides are reused instead of being explained again.
+        slides (List[SlideResult]): The explanations of the slides of the upload.
     """
     __tablename__ = "upload"
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -63,14 +123,25 @@ class Upload(Base):
     filename: Mapped[str] = mapped_column(String(128), nullable=False)
     upload_time: Mapped[DateTime] = mapped_column(DateTime, nullable=False)
     finish_time: Mapped[Optional[DateTime]] = mapped_column(DateTime)
-    status: Mapped[UploadStatus] = mapped_column(Enum(UploadStatus.pending, UploadStatus.done), default=UploadStatus.pending)
+    status: Mapped[UploadStatus] = mapped_column(Enum(UploadStatus.pending, UploadStatus.done, UploadStatus.failed),
+                                                 default=UploadStatus.pending)
     user_id: Mapped[Optional[int]] = mapped_column(ForeignKey('user.id'))
     prompt: Mapped[Optional[str]] = mapped_column(String(255), server_default="")
+    batch_id: Mapped[Optional[int]] = mapped_column(ForeignKey('batch.id'))
+    slide_count: Mapped[Optional[int]] = mapped_column(Integer)
+    timings: Mapped[Optional[str]] = mapped_column(Text)
+    last_access: Mapped[Optional[DateTime]] = mapped_column(DateTime)
+    storage_bytes: Mapped[int] = mapped_column(Integer, default=0, server_default="0")
+    deck_context: Mapped[bool] = mapped_column(Boolean, default=False, server_default="0")
+    parent_id: Mapped[Optional[int]] = mapped_column(ForeignKey('upload.id'))
+    parent: Mapped[Optional["Upload"]] = relationship("Upload", remote_side=[id], foreign_keys=[parent_id])
+    slides: Mapped[List["SlideResult"]] = relationship("SlideResult", backref='upload', lazy=True,
+                                                      cascade='all, delete-orphan')
 
     @classmethod
     def delete_by_uid(cls, uid: str, session: Session = None):
         """
-        Deletes an instance of Upload by UID.
+        Deletes an instance of Upload by UID, together with its files, see flask_retention.delete_uploads().
 
         Args:
             uid (str): The UID of the Upload to be deleted.
@@ -83,9 +154,8 @@ class Upload(Base):
             session = Session()
 
         try:
-            upload = session.query(cls).filter_by(uid=uid).one()
-            session.delete(upload)
-            session.commit()
+            from flask_imp.flask_retention import delete_uploads
+            delete_uploads(session, [session.query(cls).filter_by(uid=uid).one()])
         except Exception as e:
             session.rollback()
             raise e
@@ -93,10 +163,58 @@ class Upload(Base):
             session.close()
 
 
+class SlideResult(Base):
+    """
+    Represents the explanation of a single slide of an upload.
+    The rows are indexed by upload and slide number, so any slide or range of slides is read without
+    loading the whole result.
+    Attributes:
+        id (int): The primary key for the SlideResult table.
+        upload_id (int): The foreign key referencing the Upload table.
+        slide_number (int): The 1-based number of the slide.
+        content (bytes): The zlib compressed UTF-8 explanation of the slide.
+        text_hash (Optional[str]): The hash of the text of the slide, to find the unchanged slides of a new version
+                                   of the file.
+    """
+    __tablename__ = "slide_result"
+    __table_args__ = (UniqueConstraint('upload_id', 'slide_number'),)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    upload_id: Mapped[int] = mapped_column(ForeignKey('upload.id', ondelete='CASCADE'), nullable=False)
+    slide_number: Mapped[int] = mapped_column(Integer, nullable=False)
+    content: Mapped[bytes] = mapped_column(LargeBinary, nullable=False)
+    text_hash: Mapped[Optional[str]] = mapped_column(String(40))
+
+
+def add_missing_columns():
+    """
+    Adds the columns of the models that are missing from the existing tables, so a database created by an older
+    version keeps working. Columns are only ever added, with their server default, so this is safe to run on
+    every start.
+    """
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing:
+                    continue
+                definition = f'"{column.name}" {column.type.compile(engine.dialect)}'
+                if column.server_default is not None:
+                    default = str(column.server_default.arg).replace("'", "''")
+                    definition += f" DEFAULT '{default}'"
+                for foreign_key in column.foreign_keys:
+                    definition += f' REFERENCES "{foreign_key.column.table.name}" ("{foreign_key.column.name}")'
+                connection.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN {definition}'))
+
+
 def create_all():
     """
-    Creates all the tables defined in the models.
+    Creates all the tables defined in the models, and adds the columns missing from the tables created by an
+    older version.
 
     This function should be called when setting up the application to create the necessary tables in the database.
     """
     Base.metadata.create_all(engine)
+    add_missing_columns()
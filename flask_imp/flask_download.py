@@ -0,0 +1,63 @@
+import mimetypes
+import os
+
+from flask import current_app, request, send_file, make_response
+
+from flask_imp.flask_util import OUTPUTS_FOLDER
+from write_data.output_manage import PRECOMPRESSED_ENCODINGS
+
+DOWNLOAD_TYPES = ('txt', 'pdf', 'docx', 'json')
+PRECOMPRESSED_TYPES = ('txt', 'json')
+DOWNLOAD_CACHE_TIMEOUT = 3600  # Outputs never change for a given uid, clients revalidate with ETag after an hour
+SENDFILE_X_SENDFILE = "x-sendfile"
+SENDFILE_X_ACCEL = "x-accel"
+
+
+def select_precompressed(output_path: str) -> tuple[str, str]:
+    """
+    Picks the best pre-compressed variant of the output file accepted by the client.
+    Args:
+        output_path (str): The path of the uncompressed output file.
+    Returns:
+        tuple[str, str]: The content encoding ("" for identity) and the path of the file to send.
+    """
+    _, file_type = os.path.splitext(output_path)
+    if file_type.lstrip('.') in PRECOMPRESSED_TYPES:
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS.items():
+            if request.accept_encodings[encoding] > 0 and os.path.exists(output_path + suffix):
+                return encoding, output_path + suffix
+    return "", output_path
+
+
+def send_output(output_path: str):
+    """
+    Sends an output file as a download.
+    The response supports conditional requests (ETag / Last-Modified, 304) and HTTP Range,
+    sends a pre-compressed variant when the client accepts it, and hands the transfer
+    over to the reverse proxy when SENDFILE_MODE is configured:
+    "x-sendfile" sets the X-Sendfile header (Apache / lighttpd),
+    "x-accel" sets the X-Accel-Redirect header under X_ACCEL_PREFIX (nginx).
+    Args:
+        output_path (str): The path of the output file to send.
+    Returns:
+        Response: The download response.
+    """
+    download_name = os.path.basename(output_path)
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+    encoding, served_path = select_precompressed(output_path)
+    if current_app.config.get('SENDFILE_MODE') == SENDFILE_X_ACCEL:
+        relative_path = os.path.relpath(served_path, OUTPUTS_FOLDER).replace(os.sep, '/')
+        response = make_response('')
+        response.headers['X-Accel-Redirect'] = current_app.config.get('X_ACCEL_PREFIX', '/outputs/') + relative_path
+        response.headers['Content-Type'] = mimetype
+        response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    else:
+        # send_file uses X-Sendfile by itself when USE_X_SENDFILE is set
+        response = send_file(os.path.abspath(served_path), mimetype=mimetype, as_attachment=True,
+                             download_name=download_name, conditional=True, etag=True,
+                             max_age=DOWNLOAD_CACHE_TIMEOUT)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if os.path.splitext(download_name)[1].lstrip('.') in PRECOMPRESSED_TYPES:
+        response.vary.add('Accept-Encoding')
+    return response
@@ -1,16 +1,25 @@
 import asyncio
+import json
 import os
 import sys
 import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime
 
 from flask_imp.db_model import Session, Upload
-from flask_imp.flask_util import UPLOADS_FOLDER, OUTPUTS_FOLDER, status_pending, status_done
-from write_data.output_manage import OutputManage
-from read_data import extract_text
+from flask_imp.flask_scheduler import scheduler, Job, ANONYMOUS_USER, SCHEDULE_SMALL_FIRST
+from flask_imp.flask_util import upload_file_path, output_file_path, status_pending, status_done, status_failed
+from flask_imp.result_store import ResultStore, hash_slide
+from read_data import extract_text, count_slides
+from api.adaptive_limiter import concurrency_limiter, DEFAULT_STATE_PATH
+from api.api_request import ApiRequest
 from api.slide_handler import SlideHandler
+from monitoring.metrics import JOB_SECONDS, JOBS, FAILED_UPLOADS, SLIDES_REUSED
+from monitoring.tracing import tracer, start_trace, span, add_span, profile
 
 TIME_TO_SLEEP = 5
+POLL_INTERVAL = 0.5  # Seconds between checks for finished jobs while jobs are running
 WINDOWS_PLATFORM = 'win'
 
 
@@ -25,23 +34,259 @@ def setup_explainer():
     # Set asyncio platform
     if sys.platform.startswith(WINDOWS_PLATFORM):
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
+    # Opt-in job traces and sampled profiles, written next to the outputs
+    tracer.configure(enabled=os.getenv("TRACE_JOBS", "0").lower() in ("1", "true"),
+                     profile_every=int(os.getenv("PROFILE_EVERY_N_JOBS", "0")),
+                     profiler=os.getenv("PROFILER", "cprofile").lower())
+    # Set the scheduler quotas, the defaults process one job at a time
+    scheduler.configure(workers=int(os.getenv("EXPLAINER_WORKERS", "1")),
+                        policy=os.getenv("SCHEDULER_POLICY", SCHEDULE_SMALL_FIRST),
+                        max_jobs_per_user=int(os.getenv("MAX_JOBS_PER_USER", "1")),
+                        max_slides_per_hour=int(os.getenv("MAX_SLIDES_PER_USER_PER_HOUR", "0")))
+    # Opt-in adaptive limit of the API requests in flight, learned across restarts
+    concurrency_limiter.configure(enabled=os.getenv("ADAPTIVE_CONCURRENCY", "0").lower() in ("1", "true"),
+                                  initial_limit=int(os.getenv("CONCURRENCY_INITIAL", "10")),
+                                  min_limit=int(os.getenv("CONCURRENCY_MIN", "1")),
+                                  max_limit=int(os.getenv("CONCURRENCY_MAX", "200")),
+                                  state_path=os.getenv("CONCURRENCY_STATE_PATH", DEFAULT_STATE_PATH))
 
 
-def process_file(filename: str, custom_prompt: str = ""):
+def process_file(filename: str, custom_prompt: str = "", deck_context: bool = False):
     """
     Processes the uploaded file by extracting text from presentation slides,
-    handling the slides asynchronously, and saving the responses as JSON.
+    handling the slides asynchronously, and saving the responses in the result store.
     Args:
         filename (str): The filename of the uploaded file to be processed.
         custom_prompt (str, optional): An optional custom prompt for text generation.
                                       If not specified, a default prompt will be used.
+        deck_context (bool, optional): True to explain the slides with the outline of the surrounding slides.
     """
-    upload_path = f"{UPLOADS_FOLDER}/{filename}"
-    if os.path.exists(upload_path):
-        slides = extract_text(upload_path)
-        responses = asyncio.run(SlideHandler.response_handler(slides, custom_prompt))
-        output_path = f"{OUTPUTS_FOLDER}/{filename}"
-        OutputManage.save_to_json(responses, output_path)
+    process_files([(filename, custom_prompt, deck_context)])
+
+
+async def explain_jobs(jobs: list[tuple[list[str], str]], deck_context: list[bool] = None,
+                       reused: list[dict[int, str]] = None) -> list[list[dict] | None]:
+    """
+    Requests the explanations of the slides of the jobs over a single shared connection pool.
+    Args:
+        jobs (list[tuple[list[str], str]]): The slide contents and custom prompt of each file.
+        deck_context (list[bool], optional): True for the files explained in the cross-slide context mode.
+        reused (list[dict[int, str]], optional): The previous explanations of the unchanged slides of each file.
+    Returns:
+        list[list[dict] | None]: The response dictionaries of each file, in the order of the jobs,
+                                 None for the files with a failed slide.
+    """
+    async with ApiRequest.client():
+        return await SlideHandler.batch_response_handler(jobs, deck_context, reused)
+
+
+def process_files(files: list[tuple[str, str, bool]]) -> dict[str, dict]:
+    """
+    Processes several uploaded files together, as done for the uploads of a batch.
+    The slides of all the files are handled in a single asynchronous run,
+    and the responses of each file are saved in the result store.
+    The slides that are unchanged since the previous upload of the same file are not requested again,
+    their previous explanations are reused (see ResultStore.get_reusable()).
+    Args:
+        files (list[tuple[str, str, bool]]): The filename, custom prompt and cross-slide context mode
+                                             of each uploaded file.
+    Returns:
+        dict[str, dict]: The timing breakdown of each processed file, by filename.
+                         The API time is the time of the whole run, shared by all the files.
+                         A file with a failed slide is not saved, and its timings are marked "failed".
+                         The files in the cross-slide context mode also report the tokens of their
+                         slide summaries and the estimated tokens of the context added to their prompts.
+    """
+    with JOB_SECONDS.time():
+        jobs = []
+        jobs_deck_context = []
+        jobs_reused = []
+        jobs_hashes = []
+        jobs_filenames = []
+        timings = {}
+        for filename, custom_prompt, deck_context in files:
+            upload_path = upload_file_path(filename)
+            if os.path.exists(upload_path):
+                start = time.perf_counter()
+                with span("parse", file=filename):
+                    try:
+                        slides = extract_text(upload_path)
+                    except Exception as e:
+                        # A file that can't be parsed fails on its own, the other files of the batch go on
+                        print(f"Error in process_files: {filename}: {e}")
+                        timings[filename] = {"parse_seconds": time.perf_counter() - start, "failed": True}
+                        continue
+                    text_hashes = [hash_slide(slide_content) for slide_content in slides]
+                    reused = ResultStore.get_reusable(os.path.splitext(filename)[0], text_hashes)
+                jobs.append((slides, custom_prompt))
+                jobs_deck_context.append(deck_context)
+                jobs_reused.append(reused)
+                jobs_hashes.append(text_hashes)
+                jobs_filenames.append(filename)
+                SLIDES_REUSED.inc(len(reused))
+                timings[filename] = {"parse_seconds": time.perf_counter() - start}
+        if not jobs:
+            return timings
+        start = time.perf_counter()
+        with span("explain", slides=sum(len(slides) for slides, _ in jobs)):
+            job_responses = asyncio.run(explain_jobs(jobs, jobs_deck_context, jobs_reused))
+        api_seconds = time.perf_counter() - start
+        for filename, (slides, _), responses, deck_context, reused, text_hashes in zip(
+                jobs_filenames, jobs, job_responses, jobs_deck_context, jobs_reused, jobs_hashes):
+            if responses is None:
+                timings[filename].update({"api_seconds": api_seconds, "failed": True})
+                continue
+            start = time.perf_counter()
+            with span("persist", file=filename):
+                ResultStore.save_responses(os.path.splitext(filename)[0], responses, text_hashes)
+            usage = [response.get("usage") or {} for response in responses]
+            timings[filename].update({
+                "api_seconds": api_seconds,
+                "persist_seconds": time.perf_counter() - start,
+                "slides": len(slides),
+                "reused_slides": len(reused),
+                "prompt_tokens": sum(slide_usage.get("prompt_tokens", 0) for slide_usage in usage),
+                "completion_tokens": sum(slide_usage.get("completion_tokens", 0) for slide_usage in usage)
+            })
+            if deck_context:
+                summary_usage = [response.get("summary_usage") or {} for response in responses]
+                timings[filename].update({
+                    "summary_tokens": sum(slide_usage.get("prompt_tokens", 0) + slide_usage.get("completion_tokens", 0)
+                                          for slide_usage in summary_usage),
+                    "context_tokens": sum(response.get("context_tokens", 0) for response in responses)
+                })
+            timings[filename]["total_seconds"] = sum(timings[filename][stage] for stage in
+                                                     ("parse_seconds", "api_seconds", "persist_seconds"))
+        return timings
+
+
+def get_upload_filename(upload_file: Upload) -> str:
+    """
+    Returns the name the upload is saved under in the uploads folder.
+    Args:
+        upload_file (Upload): The upload.
+    Returns:
+        str: The UID of the upload with the extension of the original filename.
+    """
+    _, file_type = os.path.splitext(upload_file.filename)
+    return f"{upload_file.uid}{file_type}"
+
+
+def group_by_batch(upload_files: list[Upload]) -> list[list[Upload]]:
+    """
+    Groups the pending uploads into jobs: the uploads of a batch form a single job,
+    any other upload is a job of its own. Jobs keep the order of their first upload.
+    Args:
+        upload_files (list[Upload]): The pending uploads.
+    Returns:
+        list[list[Upload]]: The uploads of each job.
+    """
+    jobs = []
+    batch_jobs = {}
+    for upload_file in upload_files:
+        if upload_file.batch_id is None:
+            jobs.append([upload_file])
+        elif upload_file.batch_id in batch_jobs:
+            batch_jobs[upload_file.batch_id].append(upload_file)
+        else:
+            batch_jobs[upload_file.batch_id] = [upload_file]
+            jobs.append(batch_jobs[upload_file.batch_id])
+    return jobs
+
+
+def run_job(job: Job) -> dict[str, dict]:
+    """
+    Runs a scheduler job with the process_files() function in a worker thread.
+    When tracing is enabled, the spans of the job (from its queue wait to the saved results)
+    are exported to outputs/<uid>.trace.json for each upload of the job, and sampled jobs are
+    profiled to outputs/<uid>.prof (or .profile.html) of the first upload.
+    Args:
+        job (Job): The job to run.
+    Returns:
+        dict[str, dict]: The timing breakdown of each processed file, by filename.
+    """
+    # The shard directories are created by the trace and profile writers, only when they are enabled
+    trace_paths = [output_file_path(f"{uid}.trace.json") for uid in job.uids]
+    with start_trace(job.uids[0], trace_paths), profile(output_file_path(job.uids[0])):
+        add_span("queue", job.upload_time, datetime.now(), job_class=job.job_class)
+        with span("job", uploads=len(job.uids), slides=job.slides):
+            return process_files(job.files)
+
+
+def create_job(session, uploads: list[Upload]) -> Job | None:
+    """
+    Creates the scheduler job of a group of pending uploads.
+    The slides of uploads that were not counted yet are counted and saved on the upload.
+    An upload that can't be read (e.g. a corrupt file) is marked failed and left out of the job.
+    Args:
+        session (Session): The SQLAlchemy session of the uploads.
+        uploads (list[Upload]): The uploads of the job (a single upload, or the uploads of a batch).
+    Returns:
+        Job | None: The scheduler job, or None if none of the uploads can be read.
+    """
+    readable = []
+    for upload_file in uploads:
+        if upload_file.slide_count is None:
+            upload_path = upload_file_path(get_upload_filename(upload_file))
+            try:
+                upload_file.slide_count = count_slides(upload_path) if os.path.exists(upload_path) else 0
+            except Exception as e:
+                print(f"Error in create_job: {upload_file.uid}: {e}")
+                upload_file.status = status_failed
+                upload_file.finish_time = datetime.now()
+                FAILED_UPLOADS.inc(reason="unreadable")
+                continue
+        readable.append(upload_file)
+    session.commit()
+    if not readable:
+        return None
+    uploads = readable
+    user = uploads[0].user
+    return Job(uids=[upload_file.uid for upload_file in uploads],
+               files=[(get_upload_filename(upload_file), upload_file.prompt, bool(upload_file.deck_context))
+                      for upload_file in uploads],
+               user_key=str(user.id) if user else ANONYMOUS_USER,
+               priority=(user.priority or 0) if user else 0,
+               slides=sum(upload_file.slide_count for upload_file in uploads),
+               upload_time=min(upload_file.upload_time for upload_file in uploads))
+
+
+def finish_jobs(session, running: dict[Future, Job]):
+    """
+    Marks the uploads of the finished jobs as done (or failed, when they have no result)
+    and releases their scheduler quotas.
+    Args:
+        session (Session): The SQLAlchemy session.
+        running (dict[Future, Job]): The running jobs, finished jobs are removed from it.
+    """
+    for future in [future for future in running if future.done()]:
+        job = running.pop(future)
+        scheduler.finish(job)
+        try:
+            timings = future.result()
+        except Exception as e:
+            # The job has no result, its uploads fail instead of being explained again on every loop
+            JOBS.inc(result="error")
+            print(f"Error in finish_jobs: {e}")
+            timings = {}
+            failure_reason = "job_error"
+        else:
+            JOBS.inc(result="done")
+            failure_reason = "no_result"
+        finish_time = datetime.now()
+        for upload_file in session.query(Upload).filter(Upload.uid.in_(job.uids)).all():
+            upload_file.finish_time = finish_time
+            upload_timings = timings.get(get_upload_filename(upload_file))
+            # A missing file or a failed explanation has no result, it is never marked as done
+            if not upload_timings or upload_timings.get("failed"):
+                upload_file.status = status_failed
+                FAILED_UPLOADS.inc(reason=failure_reason)
+            else:
+                upload_file.status = status_done
+            if upload_timings:
+                upload_file.timings = json.dumps({stage: round(value, 4) if isinstance(value, float) else value
+                                                  for stage, value in upload_timings.items()})
+        session.commit()
 
 
 def explainer_system(stop_event: threading.Event):
@@ -50,24 +295,30 @@ def explainer_system(stop_event: threading.Event):
     files in the uploads folder that are not yet processed.
 
     This function runs in an infinite loop until the stop event is set.
-    It processes the files using the process_file() function and sleeps for
-    TIME_TO_SLEEP seconds between iterations.
+    The pending uploads are grouped into jobs (the uploads of a batch form a single job),
+    and the scheduler picks the jobs to run in a pool of worker threads according to
+    the user priorities and quotas. Each job is processed with the process_files() function.
+    It sleeps for TIME_TO_SLEEP seconds between iterations when no job is running.
 
     Args:
         stop_event (threading.Event): The event to signal the system to stop.
     """
-    while not stop_event.is_set():
-        with Session() as session:
-            upload_files = session.query(Upload).filter_by(status=status_pending).all()
-            for upload_file in upload_files:
-                if not stop_event.is_set():
-                    try:
-                        _, file_type = os.path.splitext(upload_file.filename)
-                        process_file(f"{upload_file.uid}{file_type}", upload_file.prompt)
-                        upload_file.finish_time = datetime.now()
-                        upload_file.status = status_done
-                        session.commit()
-                    except KeyError as e:
-                        print(e)
-                        continue
-        stop_event.wait(timeout=TIME_TO_SLEEP)
+    running: dict[Future, Job] = {}
+    with ThreadPoolExecutor(max_workers=scheduler.workers) as executor:
+        while not stop_event.is_set():
+            with Session() as session:
+                finish_jobs(session, running)
+                running_uids = {uid for job in running.values() for uid in job.uids}
+                upload_files = [upload_file for upload_file in
+                                session.query(Upload).filter_by(status=status_pending).all()
+                                if upload_file.uid not in running_uids]
+                jobs = [job for job in (create_job(session, uploads) for uploads in group_by_batch(upload_files))
+                        if job is not None]
+                for job in scheduler.next_jobs(jobs, scheduler.workers - len(running)):
+                    running[executor.submit(run_job, job)] = job
+            stop_event.wait(timeout=POLL_INTERVAL if running else TIME_TO_SLEEP)
+    # The executor waited for the running jobs, save their results before exiting
+    with Session() as session:
+        finish_jobs(session, running)
+    if concurrency_limiter.enabled:
+        concurrency_limiter.save()
@@ -0,0 +1,227 @@
+import os
+import threading
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from flask_imp.db_model import Session, Upload, SlideResult, Batch
+from flask_imp.search_index import SearchIndex
+from flask_imp.flask_util import UPLOADS_FOLDER, OUTPUTS_FOLDER, status_done, status_failed, shard_dir
+from write_data.output_manage import PRECOMPRESSED_ENCODINGS
+from monitoring.metrics import RETENTION_DELETED, RETENTION_FREED_BYTES, STORAGE_BYTES
+
+RETENTION_INTERVAL = 3600  # Default seconds between retention runs
+DELETE_CHUNK = 500  # Uploads deleted per transaction
+# The outputs written by older versions directly in the outputs folder, checked by name instead of listing it
+LEGACY_OUTPUT_SUFFIXES = ('.json', '.txt', '.pdf', '.docx', '.trace.json', '.prof', '.profile.html') + tuple(
+    file_type + suffix for file_type in ('.json', '.txt') for suffix in PRECOMPRESSED_ENCODINGS.values())
+FINISHED_STATUSES = (status_done, status_failed)  # Pending uploads are never deleted
+REASON_AGE = "age"
+REASON_IDLE = "idle"
+REASON_SIZE = "size"
+
+
+class RetentionPolicy:
+    """
+    Holds the retention settings. Only processed uploads expire, a setting of 0 disables its rule.
+    Attributes:
+        max_age (timedelta | None): Uploads finished longer ago than max_age are deleted.
+        max_idle (timedelta | None): Uploads whose result was not read for max_idle are deleted.
+        max_bytes (int): The storage budget, the least recently used uploads are deleted above it.
+        interval (float): The seconds between retention runs.
+    """
+
+    def __init__(self):
+        self.max_age = None
+        self.max_idle = None
+        self.max_bytes = 0
+        self.interval = RETENTION_INTERVAL
+
+    def configure(self, max_age_days: float, max_idle_days: float, max_bytes: int,
+                  interval: float = RETENTION_INTERVAL):
+        self.max_age = timedelta(days=max_age_days) if max_age_days > 0 else None
+        self.max_idle = timedelta(days=max_idle_days) if max_idle_days > 0 else None
+        self.max_bytes = max(0, max_bytes)
+        self.interval = interval
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.max_age or self.max_idle or self.max_bytes)
+
+
+retention = RetentionPolicy()
+
+
+def setup_retention():
+    """
+    Sets the retention policy from the environment, it is disabled by default.
+    """
+    retention.configure(max_age_days=float(os.getenv("RETENTION_MAX_AGE_DAYS", "0")),
+                        max_idle_days=float(os.getenv("RETENTION_MAX_IDLE_DAYS", "0")),
+                        max_bytes=int(float(os.getenv("RETENTION_MAX_MB", "0")) * 1000 * 1000),
+                        interval=float(os.getenv("RETENTION_INTERVAL", str(RETENTION_INTERVAL))))
+
+
+def remove_file(path: str) -> int:
+    """
+    Removes a file if it exists.
+    Returns:
+        int: The size of the removed file in bytes.
+    """
+    try:
+        size = os.path.getsize(path)
+        os.remove(path)
+        return size
+    except FileNotFoundError:
+        return 0
+
+
+def delete_upload_files(uid: str, filename: str) -> int:
+    """
+    Deletes the uploaded file and every output of an upload.
+    Only the shard directory of the upload is listed, and the legacy files of the flat folders
+    are checked by name, so the cost doesn't depend on the number of uploads.
+    Args:
+        uid (str): The UID of the upload.
+        filename (str): The original filename of the upload.
+    Returns:
+        int: The size of the deleted files in bytes.
+    """
+    freed = 0
+    for folder in (UPLOADS_FOLDER, OUTPUTS_FOLDER):
+        upload_dir = shard_dir(folder, uid)
+        if os.path.isdir(upload_dir):
+            with os.scandir(upload_dir) as entries:
+                paths = [entry.path for entry in entries if entry.name.startswith(uid)]
+            freed += sum(remove_file(path) for path in paths)
+    _, file_type = os.path.splitext(filename)
+    freed += remove_file(os.path.join(UPLOADS_FOLDER, f"{uid}{file_type}"))
+    freed += sum(remove_file(os.path.join(OUTPUTS_FOLDER, f"{uid}{suffix}")) for suffix in LEGACY_OUTPUT_SUFFIXES)
+    return freed
+
+
+def delete_uploads(session, uploads: list[Upload]) -> int:
+    """
+    Deletes uploads with their files, slide results, search index rows and emptied batches, and commits.
+    The files are deleted first, so a failure never leaves files without a row pointing to them.
+    Args:
+        session (Session): The SQLAlchemy session of the uploads.
+        uploads (list[Upload]): The uploads to delete.
+    Returns:
+        int: The size of the deleted files in bytes.
+    """
+    if not uploads:
+        return 0
+    freed = sum(delete_upload_files(upload.uid, upload.filename) for upload in uploads)
+    upload_ids = [upload.id for upload in uploads]
+    session.query(Upload).filter(Upload.parent_id.in_(upload_ids)).update({Upload.parent_id: None},
+                                                                          synchronize_session=False)
+    SearchIndex.delete(session, upload_ids)
+    session.query(SlideResult).filter(SlideResult.upload_id.in_(upload_ids)).delete(synchronize_session=False)
+    session.query(Upload).filter(Upload.id.in_(upload_ids)).delete(synchronize_session=False)
+    session.query(Batch).filter(~Batch.uploads.any()).delete(synchronize_session=False)
+    session.commit()
+    return freed
+
+
+def delete_upload(uid: str) -> bool:
+    """
+    Deletes an upload with its files, see delete_uploads().
+    Args:
+        uid (str): The UID of the upload.
+    Returns:
+        bool: True if the upload existed.
+    """
+    with Session() as session:
+        upload = session.query(Upload).filter_by(uid=uid).first()
+        if upload is None:
+            return False
+        delete_uploads(session, [upload])
+        return True
+
+
+def last_used():
+    """
+    Returns:
+        The SQL expression of the last time an upload was used: its last access, finish or upload time.
+    """
+    return func.coalesce(Upload.last_access, Upload.finish_time, Upload.upload_time)
+
+
+def expire_by_time(session, reason: str, condition) -> int:
+    """
+    Deletes the processed uploads matching a condition, DELETE_CHUNK uploads per transaction.
+    Returns:
+        int: The number of deleted uploads.
+    """
+    deleted = 0
+    while True:
+        uploads = session.query(Upload).filter(Upload.status.in_(FINISHED_STATUSES), condition).limit(
+            DELETE_CHUNK).all()
+        if not uploads:
+            return deleted
+        RETENTION_FREED_BYTES.inc(delete_uploads(session, uploads))
+        RETENTION_DELETED.inc(len(uploads), reason=reason)
+        deleted += len(uploads)
+
+
+def expire_by_size(session, max_bytes: int) -> int:
+    """
+    Deletes the least recently used processed uploads until the storage is within max_bytes.
+    Returns:
+        int: The number of deleted uploads.
+    """
+    deleted = 0
+    total = session.query(func.sum(Upload.storage_bytes)).scalar() or 0
+    while total > max_bytes:
+        candidates = session.query(Upload).filter(Upload.status.in_(FINISHED_STATUSES)).order_by(
+            last_used(), Upload.id).limit(DELETE_CHUNK).all()
+        if not candidates:
+            break
+        uploads = []
+        for upload in candidates:
+            if total <= max_bytes:
+                break
+            uploads.append(upload)
+            total -= upload.storage_bytes or 0
+        RETENTION_FREED_BYTES.inc(delete_uploads(session, uploads))
+        RETENTION_DELETED.inc(len(uploads), reason=REASON_SIZE)
+        deleted += len(uploads)
+    return deleted
+
+
+def run_retention(now: datetime = None) -> dict[str, int]:
+    """
+    Runs the retention rules once: max age, then max idle time, then the storage budget.
+    Args:
+        now (datetime, optional): The current time, datetime.now() by default.
+    Returns:
+        dict[str, int]: The number of deleted uploads by reason.
+    """
+    now = now or datetime.now()
+    deleted = {REASON_AGE: 0, REASON_IDLE: 0, REASON_SIZE: 0}
+    with Session() as session:
+        if retention.max_age:
+            deleted[REASON_AGE] = expire_by_time(session, REASON_AGE, func.coalesce(
+                Upload.finish_time, Upload.upload_time) < now - retention.max_age)
+        if retention.max_idle:
+            deleted[REASON_IDLE] = expire_by_time(session, REASON_IDLE, last_used() < now - retention.max_idle)
+        if retention.max_bytes:
+            deleted[REASON_SIZE] = expire_by_size(session, retention.max_bytes)
+        STORAGE_BYTES.set(session.query(func.sum(Upload.storage_bytes)).scalar() or 0)
+    return deleted
+
+
+def retention_system(stop_event: threading.Event):
+    """
+    Implements the background retention service, which runs the retention rules
+    every retention.interval seconds until the stop event is set.
+    Args:
+        stop_event (threading.Event): The event to signal the system to stop.
+    """
+    while not stop_event.is_set():
+        try:
+            run_retention()
+        except Exception as e:
+            print(f"Error in retention_system: {e}")
+        stop_event.wait(timeout=retention.interval)
@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+
+from monitoring.metrics import QUEUE_DEPTH, QUEUE_WAIT_SECONDS, RUNNING_JOBS
+
+SCHEDULE_FIFO = "fifo"
+SCHEDULE_SMALL_FIRST = "small-first"
+SMALL_JOB_SLIDES = 20  # Jobs with up to this many slides are in the 'small' class
+BUDGET_WINDOW = 3600  # The slide budget of each user is counted over the last hour (in seconds)
+ANONYMOUS_USER = "anonymous"  # All the uploads without an email share a single quota
+JOB_CLASSES = ("priority", "small", "large")
+
+
+class Job:
+    """
+    A unit of work of the explainer system: a single upload, or the pending uploads of a batch.
+    Attributes:
+        uids (list[str]): The UIDs of the uploads of the job.
+        files (list[tuple[str, str, bool]]): The filename in the uploads folder, custom prompt and cross-slide
+                                             context mode of each upload.
+        user_key (str): The key the quotas are counted on, the user id or ANONYMOUS_USER.
+        priority (int): The scheduling priority of the user.
+        slides (int): The total number of slides of the job.
+        upload_time (datetime): The upload time of the oldest upload of the job.
+    """
+
+    def __init__(self, uids: list[str], files: list[tuple[str, str, bool]], user_key: str, priority: int, slides: int,
+                 upload_time: datetime):
+        self.uids = uids
+        self.files = files
+        self.user_key = user_key
+        self.priority = priority
+        self.slides = slides
+        self.upload_time = upload_time
+
+    @property
+    def job_class(self) -> str:
+        """
+        Returns:
+            str: The class the queue wait time of the job is reported under.
+        """
+        if self.priority > 0:
+            return "priority"
+        return "small" if self.slides <= SMALL_JOB_SLIDES else "large"
+
+
+class JobScheduler:
+    """
+    Decides which pending jobs the explainer system starts next.
+    Jobs of higher priority users are started first. Among the others, the user that used the
+    fewest slides in the last hour goes first (fair share), and with the small-first policy a
+    user's smaller jobs go before the larger ones. A user can't run more than max_jobs_per_user
+    jobs at once, and can't start jobs over max_slides_per_hour slides per BUDGET_WINDOW
+    (0 disables the budget). A job larger than the whole budget is started when the user has
+    no usage in the window, otherwise it would never run.
+    """
+
+    def __init__(self, workers: int = 1, policy: str = SCHEDULE_SMALL_FIRST, max_jobs_per_user: int = 1,
+                 max_slides_per_hour: int = 0):
+        self.lock = threading.Lock()
+        self.workers = workers
+        self.policy = policy
+        self.max_jobs_per_user = max_jobs_per_user
+        self.max_slides_per_hour = max_slides_per_hour
+        self.running = defaultdict(int)
+        self.usage = defaultdict(deque)
+        self.queue_depth = {job_class: 0 for job_class in JOB_CLASSES}
+        self.wait_stats = {job_class: {"started": 0, "total": 0.0, "max": 0.0} for job_class in JOB_CLASSES}
+
+    def configure(self, workers: int, policy: str, max_jobs_per_user: int, max_slides_per_hour: int):
+        """
+        Updates the scheduler settings.
+        Args:
+            workers (int): The number of jobs the explainer system runs at once.
+            policy (str): SCHEDULE_SMALL_FIRST or SCHEDULE_FIFO.
+            max_jobs_per_user (int): The number of jobs a single user can run at once.
+            max_slides_per_hour (int): The slide budget of a single user per hour, 0 for no budget.
+        """
+        with self.lock:
+            self.workers = max(1, workers)
+            self.policy = policy
+            self.max_jobs_per_user = max(1, max_jobs_per_user)
+            self.max_slides_per_hour = max(0, max_slides_per_hour)
+
+    def used_slides(self, user_key: str, now: float) -> int:
+        """
+        Args:
+            user_key (str): The user key.
+            now (float): The current monotonic time.
+        Returns:
+            int: The slides of the jobs the user started in the last BUDGET_WINDOW seconds.
+        """
+        usage = self.usage[user_key]
+        while usage and usage[0][0] <= now - BUDGET_WINDOW:
+            usage.popleft()
+        return sum(slides for _, slides in usage)
+
+    def within_quota(self, job: Job, used_slides: int, running: int) -> bool:
+        """
+        Args:
+            job (Job): The pending job.
+            used_slides (int): The slides the user of the job used in the budget window.
+            running (int): The number of running jobs of the user.
+        Returns:
+            bool: True if the job can start without exceeding the user quotas.
+        """
+        if running >= self.max_jobs_per_user:
+            return False
+        if self.max_slides_per_hour and used_slides and used_slides + job.slides > self.max_slides_per_hour:
+            return False
+        return True
+
+    def next_jobs(self, jobs: list[Job], slots: int) -> list[Job]:
+        """
+        Picks the jobs to start from the pending jobs and marks them as running.
+        Args:
+            jobs (list[Job]): The pending jobs that are not running yet.
+            slots (int): The number of jobs that can be started.
+        Returns:
+            list[Job]: The jobs to start, in start order.
+        """
+        with self.lock:
+            now = time.monotonic()
+            candidates = list(jobs)
+            used = {job.user_key: self.used_slides(job.user_key, now) for job in candidates}
+            running = {job.user_key: self.running[job.user_key] for job in candidates}
+            selected = []
+            while len(selected) < slots:
+                eligible = [job for job in candidates
+                            if self.within_quota(job, used[job.user_key], running[job.user_key])]
+                if not eligible:
+                    break
+                job = min(eligible, key=lambda j: (-j.priority, used[j.user_key], running[j.user_key],
+                                                   j.slides if self.policy == SCHEDULE_SMALL_FIRST else 0,
+                                                   j.upload_time))
+                candidates.remove(job)
+                used[job.user_key] += job.slides
+                running[job.user_key] += 1
+                selected.append(job)
+                self.start(job, now)
+            self.queue_depth = {job_class: 0 for job_class in JOB_CLASSES}
+            for job in candidates:
+                self.queue_depth[job.job_class] += 1
+            for job_class, depth in self.queue_depth.items():
+                QUEUE_DEPTH.set(depth, job_class=job_class)
+            return selected
+
+    def start(self, job: Job, now: float):
+        """
+        Charges the job to its user quotas and records its queue wait time. Called with the lock held.
+        Args:
+            job (Job): The job that starts.
+            now (float): The current monotonic time.
+        """
+        self.running[job.user_key] += 1
+        self.usage[job.user_key].append((now, job.slides))
+        wait_time = max(0.0, (datetime.now() - job.upload_time).total_seconds())
+        stats = self.wait_stats[job.job_class]
+        stats["started"] += 1
+        stats["total"] += wait_time
+        stats["max"] = max(stats["max"], wait_time)
+        QUEUE_WAIT_SECONDS.observe(wait_time, job_class=job.job_class)
+        RUNNING_JOBS.inc()
+
+    def finish(self, job: Job):
+        """
+        Releases the concurrency quota of a finished job.
+        Args:
+            job (Job): The finished job.
+        """
+        with self.lock:
+            RUNNING_JOBS.dec()
+            self.running[job.user_key] -= 1
+            if self.running[job.user_key] <= 0:
+                del self.running[job.user_key]
+
+    def stats(self) -> dict:
+        """
+        Creates a dictionary object to represent the state of the scheduler,
+        including the queue depth and wait time of each job class.
+        Returns:
+            dict: The scheduler state.
+        """
+        with self.lock:
+            return {
+                'policy': self.policy,
+                'workers': self.workers,
+                'max_jobs_per_user': self.max_jobs_per_user,
+                'max_slides_per_hour': self.max_slides_per_hour,
+                'running_jobs': sum(self.running.values()),
+                'queue': {job_class: {
+                    'depth': self.queue_depth[job_class],
+                    'started': stats["started"],
+                    'wait_avg_seconds': round(stats["total"] / stats["started"], 3) if stats["started"] else 0.0,
+                    'wait_max_seconds': round(stats["max"], 3)
+                } for job_class, stats in self.wait_stats.items()}
+            }
+
+
+scheduler = JobScheduler()
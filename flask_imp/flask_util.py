@@ -1,35 +1,55 @@
+import hashlib
 import json
 import os
-from datetime import datetime
+import threading
+import shutil
+import zipfile
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, IO, Tuple
 
-from flask_imp.db_model import Session, Upload, User, UploadStatus
-from write_data.output_manage import OutputManage
+from sqlalchemy import or_
+
+from flask_imp.db_model import Session, Upload, User, UploadStatus, Batch
+from write_data.output_manage import OutputManage, PRECOMPRESSED_ENCODINGS
+from flask_imp.result_store import ResultStore
+from monitoring.tracing import start_trace, span
 UPLOADS_FOLDER = "uploads"
 OUTPUTS_FOLDER = "outputs"
+ALLOWED_EXTENSIONS = ('.pptx', '.pdf')
+MAX_BATCH_FILES = 200  # Maximum number of documents in a single batch upload
+MAX_BATCH_UNCOMPRESSED = 512 * 1000 * 1000  # Maximum total size of the documents extracted from zip archives
+ACCESS_TIME_RESOLUTION = timedelta(minutes=10)  # The last access time of an upload is updated at most this often
 status_done = UploadStatus.done
 status_pending = UploadStatus.pending
+status_failed = UploadStatus.failed
 
 
 def get_output_path(filename: str) -> str:
     """
-    Retrieves the path to the output file associated with the given filename.
+    Retrieves the path to the output file associated with the given filename,
+    rendering it from the JSON output if it doesn't exist yet.
     Args:
         filename (str): The filename for which to retrieve the output path.
     Returns:
         str: The path to the output file.
     """
-    output_path = os.path.join(OUTPUTS_FOLDER, filename)
+    output_path = output_file_path(filename, create=True)
     if not os.path.exists(output_path):
         name, file_type = os.path.splitext(filename)
-        response = load_json_file(name)
-        if file_type == '.pdf':
-            OutputManage.save_to_pdf(response, output_path)
-        elif file_type == '.txt':
-            OutputManage.save_to_txt(response, output_path)
-        elif file_type == '.docx':
-            OutputManage.save_to_docx(response, output_path)
+        # The render spans are added to the trace of the job, when tracing is enabled
+        with start_trace(name, [output_file_path(f"{name}.trace.json")]), \
+                span("render", format=file_type.lstrip('.')):
+            response = load_json_file(name)
+            if file_type == '.json':
+                OutputManage.save_to_json(response, output_path)
+            elif file_type == '.pdf':
+                OutputManage.save_to_pdf(response, output_path)
+            elif file_type == '.txt':
+                OutputManage.save_to_txt(response, output_path)
+            elif file_type == '.docx':
+                OutputManage.save_to_docx(response, output_path)
+        add_storage_bytes(name, sum(os.path.getsize(path) for path in rendered_files(output_path)))
     if os.path.exists(output_path):
         return output_path
     return ""
@@ -37,14 +57,18 @@ def get_output_path(filename: str) -> str:
 
 def load_json_file(filename: str) -> List[Dict]:
     """
-    Loads the content of the output file associated with the given filename as a JSON object.
+    Loads the content of the output associated with the given filename as a JSON object.
+    The result store is read first, the JSON output file is the fallback for results saved before it.
     Args:
         filename (str): The filename of the output file to be loaded.
     Returns:
         Dict: The loaded JSON content as a dictionary.
     """
     name, _ = os.path.splitext(filename)
-    output_path = os.path.join(OUTPUTS_FOLDER, f"{name}.json")
+    slides = ResultStore.get_slides(name)
+    if slides:
+        return slides
+    output_path = output_file_path(f"{name}.json")
     try:
         with open(output_path, 'r') as file:
             return json.load(file)
@@ -53,6 +77,106 @@ def load_json_file(filename: str) -> List[Dict]:
         return []
 
 
+def shard_dir(folder: str, uid: str) -> str:
+    """
+    Args:
+        folder (str): UPLOADS_FOLDER or OUTPUTS_FOLDER.
+        uid (str): The UID of the upload.
+    Returns:
+        str: The shard subdirectory of the files of the upload, folder/ab/cd.
+    """
+    digest = hashlib.sha1(uid.encode('utf-8')).hexdigest()
+    return os.path.join(folder, digest[:2], digest[2:4])
+
+
+def shard_path(folder: str, filename: str, create: bool = False) -> str:
+    """
+    Returns the path of a file of an upload in the uploads or outputs folder.
+    The files are sharded by the hash of the upload UID (the filename up to its first dot) into two levels
+    of subdirectories, folder/ab/cd/filename, so no directory grows with the number of uploads.
+    Files saved directly in the folder by older versions are still found there.
+    Args:
+        folder (str): UPLOADS_FOLDER or OUTPUTS_FOLDER.
+        filename (str): The filename, starting with the UID of the upload.
+        create (bool, optional): True to create the shard directory, before writing the file.
+    Returns:
+        str: The path of the file.
+    """
+    upload_dir = shard_dir(folder, filename.split('.', 1)[0])
+    path = os.path.join(upload_dir, filename)
+    if create:
+        os.makedirs(upload_dir, exist_ok=True)
+    elif not os.path.exists(path):
+        legacy_path = os.path.join(folder, filename)
+        if os.path.exists(legacy_path):
+            return legacy_path
+    return path
+
+
+def upload_file_path(filename: str, create: bool = False) -> str:
+    """
+    Returns the path of an uploaded file, see shard_path().
+    """
+    return shard_path(UPLOADS_FOLDER, filename, create)
+
+
+def output_file_path(filename: str, create: bool = False) -> str:
+    """
+    Returns the path of an output file, see shard_path().
+    """
+    return shard_path(OUTPUTS_FOLDER, filename, create)
+
+
+def rendered_files(output_path: str) -> List[str]:
+    """
+    Returns:
+        List[str]: The output file and its precompressed variants that exist.
+    """
+    return [path for path in [output_path] + [output_path + suffix for suffix in
+                                              PRECOMPRESSED_ENCODINGS.values()]
+            if os.path.exists(path)]
+
+
+def add_storage_bytes(uid: str, size: int):
+    """
+    Adds the size of new files of an upload to its storage_bytes, used by the retention size budget.
+    Args:
+        uid (str): The UID of the upload.
+        size (int): The size of the new files in bytes.
+    """
+    with Session() as session:
+        session.query(Upload).filter_by(uid=uid).update({Upload.storage_bytes: Upload.storage_bytes + size},
+                                                        synchronize_session=False)
+        session.commit()
+
+
+_last_touch: Dict[str, datetime] = {}
+_last_touch_lock = threading.Lock()
+
+
+def touch_upload(uid: str):
+    """
+    Records an access to the result of an upload, for the LRU retention.
+    The database is only written when the last access is older than ACCESS_TIME_RESOLUTION,
+    so reading a result doesn't take the database write lock on every request.
+    Args:
+        uid (str): The UID of the upload.
+    """
+    now = datetime.now()
+    with _last_touch_lock:
+        last_touch = _last_touch.get(uid)
+        if last_touch is not None and now - last_touch < ACCESS_TIME_RESOLUTION:
+            return
+        if len(_last_touch) > 100_000:
+            _last_touch.clear()
+        _last_touch[uid] = now
+    with Session() as session:
+        session.query(Upload).filter(Upload.uid == uid, or_(Upload.last_access.is_(None),
+                                                            Upload.last_access < now - ACCESS_TIME_RESOLUTION)
+                                     ).update({Upload.last_access: now}, synchronize_session=False)
+        session.commit()
+
+
 def save_to_json(uid: str, upload_status: str, name: str, finish_time: datetime = None, explanation=None):
     """
     Creates a dictionary object to represent the upload status, including the
@@ -86,7 +210,7 @@ def set_path():
     Path(OUTPUTS_FOLDER).mkdir(parents=True, exist_ok=True)
 
 
-def save_upload(file, prompt: str) -> str:
+def save_upload(file, prompt: str, deck_context: bool = False) -> str:
     """
     Saves the uploaded file as an anonymous upload.
     This function creates an Upload object in the database to represent the uploaded file
@@ -95,42 +219,192 @@ def save_upload(file, prompt: str) -> str:
     Args:
         file (FileStorage): The uploaded file to be saved.
         prompt (str): Free text prompt associated with the upload
+        deck_context (bool, optional): True to explain the slides with the outline of the surrounding slides.
     Returns:
         str: The UID associated with the uploaded file.
     """
     with Session() as session:
-        anonymous_upload = Upload(filename=file.filename, upload_time=datetime.now(), prompt=prompt)
+        anonymous_upload = Upload(filename=file.filename, upload_time=datetime.now(), prompt=prompt,
+                                  deck_context=deck_context)
         session.add(anonymous_upload)
-        session.commit()
+        session.flush()
+        # Save the file before the commit, so the explainer never sees an upload without its file
         _, file_type = os.path.splitext(file.filename)
-        file.save(os.path.join(UPLOADS_FOLDER, f"{anonymous_upload.uid}{file_type}"))
+        upload_path = upload_file_path(f"{anonymous_upload.uid}{file_type}", create=True)
+        file.save(upload_path)
+        anonymous_upload.storage_bytes = os.path.getsize(upload_path)
+        session.commit()
         return anonymous_upload.uid
 
 
-def save_upload_with_user(file, email: str, prompt: str) -> str:
+def save_upload_with_user(file, email: str, prompt: str, deck_context: bool = False) -> str:
     """
     Saves the uploaded file with the associated user.
     This function creates a User object in the database if the user with the provided
-    email doesn't exist. It then creates an Upload object associated with the user and
-    saves the file to the uploads folder using a generated UID. The function returns
-    the UID associated with the uploaded file.
+    email doesn't exist. It then creates an Upload object associated with the user, linked to the
+    previous upload of the same file by the user (see get_previous_upload()), and saves the file to
+    the uploads folder using a generated UID. The function returns the UID associated with the uploaded file.
 
     Args:
         file (FileStorage): The uploaded file to be saved.
         email (str): The email of the user associated with the uploaded file.
         prompt (str): Free text prompt associated with the upload
+        deck_context (bool, optional): True to explain the slides with the outline of the surrounding slides.
     Returns:
         str: The UID associated with the uploaded file.
     """
     with Session() as session:
-        user = session.query(User).filter_by(email=email).first()
-        if not user:
-            user = User(email=email)
-            session.add(user)
-            session.commit()
-        user_upload = Upload(filename=file.filename, upload_time=datetime.now(), user=user, prompt=prompt)
+        user = get_or_create_user(session, email)
+        user_upload = Upload(filename=file.filename, upload_time=datetime.now(), user=user, prompt=prompt,
+                             deck_context=deck_context, parent=get_previous_upload(session, user, file.filename))
         session.add(user_upload)
-        session.commit()
+        session.flush()
+        # Save the file before the commit, so the explainer never sees an upload without its file
         _, file_type = os.path.splitext(file.filename)
-        file.save(os.path.join(UPLOADS_FOLDER, f"{user_upload.uid}{file_type}"))
+        upload_path = upload_file_path(f"{user_upload.uid}{file_type}", create=True)
+        file.save(upload_path)
+        user_upload.storage_bytes = os.path.getsize(upload_path)
+        session.commit()
         return user_upload.uid
+
+
+def get_or_create_user(session, email: str) -> User:
+    """
+    Retrieves the user with the given email, adding a new one to the session if it doesn't exist.
+    The new user is only flushed, so it is committed in the same transaction as the caller's uploads.
+    Args:
+        session (Session): The SQLAlchemy session.
+        email (str): The email of the user.
+    Returns:
+        User: The existing or newly added user.
+    """
+    user = session.query(User).filter_by(email=email).first()
+    if not user:
+        user = User(email=email)
+        session.add(user)
+        session.flush()
+    return user
+
+
+def get_previous_upload(session, user: User, filename: str) -> Upload | None:
+    """
+    Retrieves the latest explained upload of a file by a user, the parent of a new upload of the same file,
+    whose unchanged slides are reused by the explainer. The pending and failed uploads are skipped.
+    Args:
+        session (Session): The SQLAlchemy session.
+        user (User): The user.
+        filename (str): The original filename.
+    Returns:
+        Upload | None: The latest done upload, or None if the user has no explained upload of the file.
+    """
+    return session.query(Upload).filter_by(user_id=user.id, filename=filename, status=status_done).order_by(
+        Upload.upload_time.desc(), Upload.id.desc()).first()
+
+
+def expand_batch_files(files) -> List[Tuple[str, IO]]:
+    """
+    Lists the documents of a batch upload, extracting pptx and pdf files from zip archives.
+    Files with other extensions are skipped.
+    Args:
+        files (list[FileStorage]): The uploaded files.
+    Returns:
+        list[tuple[str, IO]]: The filename and a readable stream of each document.
+    Raises:
+        ValueError: If the batch has too many documents or the archives are too large.
+    """
+    documents = []
+    uncompressed_size = 0
+    for file in files:
+        _, file_type = os.path.splitext(file.filename.lower())
+        if file_type == '.zip':
+            archive = zipfile.ZipFile(file.stream)
+            for info in archive.infolist():
+                name = os.path.basename(info.filename)
+                if info.is_dir() or not name.lower().endswith(ALLOWED_EXTENSIONS):
+                    continue
+                uncompressed_size += info.file_size
+                if uncompressed_size > MAX_BATCH_UNCOMPRESSED:
+                    raise ValueError("The zip archives are too large")
+                documents.append((name, archive.open(info)))
+        elif file_type in ALLOWED_EXTENSIONS:
+            documents.append((file.filename, file.stream))
+        if len(documents) > MAX_BATCH_FILES:
+            raise ValueError(f"A batch can contain at most {MAX_BATCH_FILES} files")
+    return documents
+
+
+def save_batch(files, email: str, prompt: str, deck_context: bool = False) -> Tuple[str, List[str]]:
+    """
+    Saves the files of a batch upload.
+    This function creates a Batch object and an Upload object for every document
+    (zip archives are extracted) and commits all of them in a single transaction.
+    The documents are saved to the uploads folder before the commit; if any of them
+    fails, the transaction is rolled back and the saved files are removed.
+    Args:
+        files (list[FileStorage]): The uploaded files.
+        email (str): The optional email of the user associated with the batch.
+        prompt (str): Free text prompt associated with every upload of the batch.
+        deck_context (bool, optional): True to explain the slides with the outline of the surrounding slides.
+    Returns:
+        tuple[str, list[str]]: The UID of the batch and the UIDs of its uploads.
+    Raises:
+        ValueError: If the batch doesn't contain any pptx or pdf file, or is too large.
+    """
+    documents = expand_batch_files(files)
+    if not documents:
+        raise ValueError("No pptx or pdf file found")
+    saved_paths = []
+    with Session() as session:
+        try:
+            user = get_or_create_user(session, email) if email else None
+            upload_time = datetime.now()
+            batch = Batch(upload_time=upload_time, user_id=user.id if user else None)
+            parents = [get_previous_upload(session, user, filename) if user else None for filename, _ in documents]
+            batch_uploads = [Upload(filename=filename, upload_time=upload_time, user=user, prompt=prompt, batch=batch,
+                                    deck_context=deck_context, parent=parent)
+                             for (filename, _), parent in zip(documents, parents)]
+            session.add(batch)
+            session.add_all(batch_uploads)
+            session.flush()
+            for batch_upload, (filename, stream) in zip(batch_uploads, documents):
+                _, file_type = os.path.splitext(filename)
+                upload_path = upload_file_path(f"{batch_upload.uid}{file_type}", create=True)
+                saved_paths.append(upload_path)
+                with open(upload_path, 'wb') as upload_file:
+                    shutil.copyfileobj(stream, upload_file)
+                batch_upload.storage_bytes = os.path.getsize(upload_path)
+            session.commit()
+        except Exception:
+            session.rollback()
+            for upload_path in saved_paths:
+                if os.path.exists(upload_path):
+                    os.remove(upload_path)
+            raise
+        return batch.uid, [batch_upload.uid for batch_upload in batch_uploads]
+
+
+def get_batch_progress(batch_uid: str) -> Dict | None:
+    """
+    Creates a dictionary object to represent the aggregate progress of a batch.
+    Args:
+        batch_uid (str): The UID of the batch.
+    Returns:
+        Dict | None: The batch progress, or None if the batch doesn't exist.
+    """
+    with Session() as session:
+        batch = session.query(Batch).filter_by(uid=batch_uid).first()
+        if not batch:
+            return None
+        uploads = [save_to_json(batch_upload.uid, batch_upload.status, batch_upload.filename, batch_upload.finish_time)
+                   for batch_upload in batch.uploads]
+        done = sum(1 for batch_upload in uploads if batch_upload['status'] == status_done)
+        failed = sum(1 for batch_upload in uploads if batch_upload['status'] == status_failed)
+        return {
+            'batch_uid': batch.uid,
+            'total': len(uploads),
+            'done': done,
+            'failed': failed,
+            'pending': len(uploads) - done - failed,
+            'progress': round(100 * (done + failed) / len(uploads), 1) if uploads else 100.0,
+            'uploads': uploads
+        }
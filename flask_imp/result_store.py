@@ -0,0 +1,156 @@
+import hashlib
+import zlib
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional
+
+from flask_imp.db_model import Session, Upload, SlideResult, UploadStatus
+from flask_imp.search_index import SearchIndex
+from write_data.output_manage import OutputManage
+
+COMPRESSION_LEVEL = 6
+
+
+def compress(content: str) -> bytes:
+    return zlib.compress(content.encode('utf-8'), COMPRESSION_LEVEL)
+
+
+def decompress(content: bytes) -> str:
+    return zlib.decompress(content).decode('utf-8')
+
+
+def hash_slide(slide_content: str) -> str:
+    """
+    Returns:
+        str: The SHA-1 of the text of a slide with its whitespace collapsed, an empty string for an empty slide.
+    """
+    text = " ".join(slide_content.split())
+    return hashlib.sha1(text.encode('utf-8')).hexdigest() if text else ""
+
+
+def to_slide(slide_result: SlideResult) -> Dict:
+    """
+    Returns:
+        Dict: The slide in the shape of the JSON output, {"slide_number": ..., "content": ...}.
+    """
+    return {"slide_number": slide_result.slide_number, "content": decompress(slide_result.content)}
+
+
+class ResultStore:
+    """
+    Stores the explanations of the uploads as one compressed row per slide,
+    so a single slide, a range of slides or the slide count are read without loading the whole result.
+    """
+
+    @staticmethod
+    def save(uid: str, contents: List[str], text_hashes: List[str] = None):
+        """
+        Saves the explanations of an upload, replacing any previous ones, and updates the search index
+        in the same transaction.
+        Args:
+            uid (str): The UID of the upload.
+            contents (List[str]): The explanation of each slide, in slide order.
+            text_hashes (List[str], optional): The hash_slide() of the text of each slide, in slide order.
+        Raises:
+            sqlalchemy.orm.exc.NoResultFound: If no upload with the specified UID is found.
+        """
+        text_hashes = text_hashes or [None] * len(contents)
+        with Session() as session:
+            upload = session.query(Upload).filter_by(uid=uid).one()
+            session.query(SlideResult).filter_by(upload_id=upload.id).delete()
+            session.add_all(SlideResult(upload_id=upload.id, slide_number=slide_number, content=compress(content),
+                                        text_hash=text_hash)
+                            for slide_number, (content, text_hash) in enumerate(zip(contents, text_hashes), start=1))
+            SearchIndex.index_upload(session, upload, contents)
+            session.commit()
+
+    @staticmethod
+    def save_responses(uid: str, responses: List[dict], text_hashes: List[str] = None):
+        """
+        Saves the API responses of an upload, see save().
+        The slides answered with an API error are saved without their text hash, so they are never reused.
+        Args:
+            uid (str): The UID of the upload.
+            responses (List[dict]): The API response of each slide, in slide order.
+            text_hashes (List[str], optional): The hash_slide() of the text of each slide, in slide order.
+        """
+        if text_hashes:
+            text_hashes = [None if response.get("error") else text_hash
+                           for response, text_hash in zip(responses, text_hashes)]
+        ResultStore.save(uid, OutputManage.get_content(responses), text_hashes)
+
+    @staticmethod
+    def get_reusable(uid: str, text_hashes: List[str]) -> Dict[int, str]:
+        """
+        Finds the slides of an upload that are unchanged since its parent upload (the previous upload of
+        the same file by the same user), and returns their stored explanations.
+        The slide hashes of both versions are aligned with difflib, so the slides keep their explanation
+        when slides are inserted or deleted before them. Explanations are only reused when both uploads
+        have the same prompt, and not in the cross-slide context mode, where they depend on other slides.
+        Args:
+            uid (str): The UID of the upload.
+            text_hashes (List[str]): The hash_slide() of the text of each slide of the upload, in slide order.
+        Returns:
+            Dict[int, str]: The reused explanation of each unchanged slide, by its slide number in the upload.
+        """
+        with Session() as session:
+            upload = session.query(Upload).filter_by(uid=uid).first()
+            parent = upload.parent if upload else None
+            if parent is None or parent.status != UploadStatus.done or upload.deck_context or parent.deck_context \
+                    or (parent.prompt or "") != (upload.prompt or ""):
+                return {}
+            rows = session.query(SlideResult.text_hash, SlideResult.content).filter_by(
+                upload_id=parent.id).order_by(SlideResult.slide_number).all()
+        # The slides without a hash (saved before the slide hashes, or answered with an API error) never match
+        parent_hashes = [text_hash for text_hash, _ in rows]
+        if all(text_hash is None for text_hash in parent_hashes):
+            return {}
+        reusable = {}
+        for block in SequenceMatcher(None, parent_hashes, text_hashes, autojunk=False).get_matching_blocks():
+            for offset in range(block.size):
+                # The explanation of an empty slide is its slide number, it isn't worth reusing
+                if text_hashes[block.b + offset]:
+                    reusable[block.b + offset + 1] = decompress(rows[block.a + offset][1])
+        return reusable
+
+    @staticmethod
+    def count(uid: str) -> int:
+        """
+        Args:
+            uid (str): The UID of the upload.
+        Returns:
+            int: The number of stored slides of the upload.
+        """
+        with Session() as session:
+            return session.query(SlideResult).join(Upload).filter(Upload.uid == uid).count()
+
+    @staticmethod
+    def get_slide(uid: str, slide_number: int) -> Optional[Dict]:
+        """
+        Args:
+            uid (str): The UID of the upload.
+            slide_number (int): The 1-based number of the slide.
+        Returns:
+            Optional[Dict]: The slide, or None if it doesn't exist.
+        """
+        with Session() as session:
+            slide_result = session.query(SlideResult).join(Upload).filter(
+                Upload.uid == uid, SlideResult.slide_number == slide_number).first()
+            return to_slide(slide_result) if slide_result else None
+
+    @staticmethod
+    def get_slides(uid: str, first: int = 1, last: Optional[int] = None) -> List[Dict]:
+        """
+        Args:
+            uid (str): The UID of the upload.
+            first (int, optional): The number of the first slide of the range.
+            last (int, optional): The number of the last slide of the range (included), up to the last slide if None.
+        Returns:
+            List[Dict]: The slides of the range in the shape of the JSON output.
+        """
+        with Session() as session:
+            query = session.query(SlideResult).join(Upload).filter(Upload.uid == uid,
+                                                                    SlideResult.slide_number >= first)
+            if last is not None:
+                query = query.filter(SlideResult.slide_number <= last)
+            return [to_slide(slide_result) for slide_result in query.order_by(SlideResult.slide_number)]
+
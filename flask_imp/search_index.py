@@ -0,0 +1,183 @@
+import re
+from typing import Dict, List
+
+from sqlalchemy import text
+
+from flask_imp.db_model import Session, Upload, SlideResult, engine
+
+SLIDE_BITS = 20  # The row id of an index row is upload_id << SLIDE_BITS | slide_number
+SLIDE_MASK = (1 << SLIDE_BITS) - 1
+# bm25 weights of the filename, prompt and content columns: a match in the filename ranks first
+RANK_FUNCTION = "bm25(10.0, 3.0, 1.0)"
+MAX_PER_PAGE = 100
+MAX_RANKED_MATCHES = 10000  # Broader queries only rank their newest matches
+REBUILD_CHUNK = 1000  # Uploads indexed per transaction when the index is rebuilt
+SNIPPET_TOKENS = 16  # Words of the text shown around a match
+
+
+def get_match_query(query: str) -> str:
+    """
+    Converts free text into an FTS5 query: every word must match, the last one as a prefix,
+    so the special characters of the FTS5 syntax in the text never cause an error.
+    Args:
+        query (str): The text to search for.
+    Returns:
+        str: The FTS5 query, or an empty string if the text has no words.
+    """
+    words = re.findall(r"\w+", query)
+    if not words:
+        return ""
+    return " ".join(f'"{word}"' for word in words[:-1]) + f' "{words[-1]}"*'
+
+
+def get_snippet(content: str, query: str) -> str:
+    """
+    Cuts the part of a text around the first match of a query, the matched words marked with brackets.
+    Args:
+        content (str): The text of the index row.
+        query (str): The text that was searched for.
+    Returns:
+        str: About SNIPPET_TOKENS words of the text, starting a few words before the first match.
+    """
+    words = content.split()
+    terms = [term.lower() for term in re.findall(r"\w+", query)]
+    matches = [any(word.lower().strip(".,;:!?()\"'").startswith(term) for term in terms) for word in words]
+    first = matches.index(True) if True in matches else 0
+    start = max(0, first - SNIPPET_TOKENS // 4)
+    end = start + SNIPPET_TOKENS
+    snippet = " ".join(f"[{word}]" if match else word for word, match in zip(words[start:end], matches[start:end]))
+    return ("..." if start else "") + snippet + ("..." if end < len(words) else "")
+
+
+class SearchIndex:
+    """
+    A SQLite FTS5 full-text index of the filename, prompt and slide explanations of the uploads.
+    Each upload has one row with its filename and prompt (slide number 0) and one row per explained slide.
+    The row ids encode the upload and slide numbers, so the rows of an upload are replaced or deleted by
+    a range of row ids, and the search never reads the output files.
+    """
+
+    @staticmethod
+    def create() -> bool:
+        """
+        Creates the index table if it doesn't exist, and indexes the results saved before it.
+        Returns:
+            bool: True if the index was created.
+        """
+        with engine.begin() as connection:
+            exists = connection.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'")).first()
+            if exists:
+                return False
+            connection.execute(text("CREATE VIRTUAL TABLE search_index USING fts5("
+                                    "filename, prompt, content, tokenize = 'unicode61 remove_diacritics 2')"))
+            connection.execute(text("INSERT INTO search_index(search_index, rank) VALUES ('rank', :rank)"),
+                               {"rank": RANK_FUNCTION})
+        SearchIndex.rebuild()
+        return True
+
+    @staticmethod
+    def rebuild():
+        """
+        Indexes the stored results of every upload, REBUILD_CHUNK uploads per transaction.
+        """
+        from flask_imp.result_store import decompress
+        last_id = 0
+        while True:
+            with Session() as session:
+                uploads = session.query(Upload).filter(Upload.id > last_id, Upload.slides.any()).order_by(
+                    Upload.id).limit(REBUILD_CHUNK).all()
+                if not uploads:
+                    return
+                for upload in uploads:
+                    contents = [decompress(content) for content, in session.query(SlideResult.content).filter_by(
+                        upload_id=upload.id).order_by(SlideResult.slide_number)]
+                    SearchIndex.index_upload(session, upload, contents)
+                last_id = uploads[-1].id
+                session.commit()
+
+    @staticmethod
+    def index_upload(session, upload: Upload, contents: List[str]):
+        """
+        Replaces the index rows of an upload, in the transaction of the session.
+        Args:
+            session (Session): The SQLAlchemy session.
+            upload (Upload): The upload.
+            contents (List[str]): The explanation of each slide, in slide order.
+        """
+        SearchIndex.delete(session, [upload.id])
+        first_row = upload.id << SLIDE_BITS
+        session.execute(text("INSERT INTO search_index(rowid, filename, prompt, content) "
+                             "VALUES (:rowid, :filename, :prompt, '')"),
+                        {"rowid": first_row, "filename": upload.filename, "prompt": upload.prompt or ""})
+        if contents:
+            session.execute(text("INSERT INTO search_index(rowid, filename, prompt, content) "
+                                 "VALUES (:rowid, '', '', :content)"),
+                            [{"rowid": first_row + slide_number, "content": content}
+                             for slide_number, content in enumerate(contents[:SLIDE_MASK], start=1)])
+
+    @staticmethod
+    def delete(session, upload_ids: List[int]):
+        """
+        Deletes the index rows of uploads, in the transaction of the session.
+        Args:
+            session (Session): The SQLAlchemy session.
+            upload_ids (List[int]): The ids of the uploads.
+        """
+        for upload_id in upload_ids:
+            session.execute(text("DELETE FROM search_index WHERE rowid BETWEEN :first AND :last"),
+                            {"first": upload_id << SLIDE_BITS, "last": (upload_id << SLIDE_BITS) | SLIDE_MASK})
+
+    @staticmethod
+    def search(query: str, page: int = 1, per_page: int = 20, email: str = None) -> Dict:
+        """
+        Searches the filenames, prompts and slide explanations, best matches first (bm25 ranking,
+        filename matches weighted above prompt matches, above explanation matches).
+        The ranking cost grows with the number of matches, so when a query matches more than
+        MAX_RANKED_MATCHES rows only the newest of them are ranked, and the snippets are only
+        cut from the rows of the page.
+        Args:
+            query (str): The text to search for, every word must match.
+            page (int, optional): The 1-based page of results.
+            per_page (int, optional): The number of results per page, at most MAX_PER_PAGE.
+            email (str, optional): Only search the uploads of the user with this email.
+        Returns:
+            Dict: The query, page, per_page, the total number of matches, whether only the newest matches were
+                  ranked, and the results of the page, each with the upload uid, filename, status,
+                  slide number (0 for a filename or prompt match), a snippet of the match and its score.
+        """
+        page = max(1, page)
+        per_page = min(MAX_PER_PAGE, max(1, per_page))
+        match_query = get_match_query(query)
+        result = {'query': query, 'page': page, 'per_page': per_page, 'total': 0, 'ranked_newest_only': False,
+                  'results': []}
+        if not match_query:
+            return result
+        params = {"match": match_query, "email": email, "limit": per_page, "offset": (page - 1) * per_page,
+                  "max_ranked": MAX_RANKED_MATCHES - 1}
+        user_filter = f"AND search_index.rowid >> {SLIDE_BITS} IN (SELECT upload.id FROM upload JOIN user " \
+                      f"ON user.id = upload.user_id WHERE user.email = :email)" if email else ""
+        with Session() as session:
+            result['total'] = session.execute(text(
+                f"SELECT count(*) FROM search_index WHERE search_index MATCH :match {user_filter}"), params).scalar()
+            params["first_ranked"] = session.execute(text(
+                f"SELECT rowid FROM search_index WHERE search_index MATCH :match {user_filter} "
+                f"ORDER BY rowid DESC LIMIT 1 OFFSET :max_ranked"), params).scalar() or 0
+            result['ranked_newest_only'] = params["first_ranked"] > 0
+            hits = session.execute(text(
+                f"SELECT rowid, rank FROM search_index WHERE search_index MATCH :match {user_filter} "
+                f"AND rowid >= :first_ranked ORDER BY rank LIMIT :limit OFFSET :offset"), params).all()
+            if not hits:
+                return result
+            row_ids = ", ".join(str(row_id) for row_id, _ in hits)
+            # Reading the rows by row id is cheap, the FTS5 snippet() function would re-run the whole query
+            snippets = {row_id: get_snippet(" ".join(filter(None, columns)), query)
+                        for row_id, *columns in session.execute(text(
+                            f"SELECT rowid, filename, prompt, content FROM search_index WHERE rowid IN ({row_ids})"))}
+            uploads = {upload.id: upload for upload in session.query(Upload).filter(
+                Upload.id.in_({row_id >> SLIDE_BITS for row_id, _ in hits}))}
+            result['results'] = [{'uid': upload.uid, 'filename': upload.filename, 'status': upload.status,
+                                  'slide_number': row_id & SLIDE_MASK, 'snippet': snippets.get(row_id, ""),
+                                  'score': round(-rank, 4)}
+                                 for row_id, rank in hits if (upload := uploads.get(row_id >> SLIDE_BITS))]
+        return result
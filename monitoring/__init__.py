@@ -0,0 +1,5 @@
+from . import metrics
+from . import tracing
+
+
+__all__ = ['metrics', 'tracing']
@@ -0,0 +1,230 @@
+"""
+metrics.py
+
+This module keeps in-process counters, gauges and histograms of the explainer pipeline
+and renders them in the Prometheus text exposition format.
+"""
+import threading
+import time
+from contextlib import ContextDecorator
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Registry:
+    """
+    Holds the registered metrics and renders all of them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = []
+
+    def register(self, metric):
+        with self.lock:
+            self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """
+        Returns:
+            str: All the metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            metrics = list(self.metrics)
+        return "".join(metric.render() for metric in metrics)
+
+
+REGISTRY = Registry()
+
+
+def escape_label(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(labelnames: tuple, values: tuple, le: str = "") -> str:
+    pairs = [f'{name}="{escape_label(value)}"' for name, value in zip(labelnames, values)]
+    if le:
+        pairs.append(f'le="{le}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric:
+    """
+    Base class of the metrics, a value per combination of label values.
+    """
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.register(self)
+
+    def label_values(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def samples(self) -> dict:
+        """
+        Returns:
+            dict: A copy of the current values, by tuple of label values.
+        """
+        with self.lock:
+            return dict(self.values)
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} {self.metric_type}\n"]
+        with self.lock:
+            for values, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(self.labelnames, values)} {value}\n")
+        return "".join(lines)
+
+
+class Counter(Metric):
+    """
+    A value that only goes up, e.g. the number of API requests.
+    """
+    metric_type = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def get(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self.label_values(labels), 0)
+
+
+class Gauge(Counter):
+    """
+    A value that goes up and down, e.g. the number of pending jobs.
+    """
+    metric_type = "gauge"
+
+    def set(self, value: float, **labels):
+        with self.lock:
+            self.values[self.label_values(labels)] = value
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Timer(ContextDecorator):
+    """
+    Observes the time spent in a block (or a decorated function) on a histogram.
+    """
+
+    def __init__(self, histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+        self.start = 0.0
+        self.elapsed = 0.0
+
+    def _recreate_cm(self):
+        # Every call of a decorated function gets its own timer, so concurrent calls don't share a start time
+        return Timer(self.histogram, self.labels)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.elapsed = time.perf_counter() - self.start
+        self.histogram.observe(self.elapsed, **self.labels)
+        return False
+
+
+class Histogram(Metric):
+    """
+    Counts observed values (usually durations in seconds) in cumulative buckets.
+    """
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS,
+                 registry: Registry = REGISTRY):
+        super().__init__(name, documentation, labelnames, registry)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for index, bucket in enumerate(self.buckets):
+                if value <= bucket:
+                    counts[index] += 1
+            self.values[key] = (counts, total + value, count + 1)
+
+    def time(self, **labels) -> Timer:
+        """
+        Args:
+            **labels: The label values of the observation.
+        Returns:
+            Timer: A context manager (or decorator) observing the elapsed time.
+        """
+        return Timer(self, labels)
+
+    def get_count(self, **labels) -> int:
+        with self.lock:
+            return self.values.get(self.label_values(labels), (None, 0.0, 0))[2]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}\n", f"# TYPE {self.name} {self.metric_type}\n"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.values.items()):
+                for bucket, bucket_count in zip(self.buckets, counts):
+                    labels = format_labels(self.labelnames, key, str(bucket))
+                    lines.append(f"{self.name}_bucket{labels} {bucket_count}\n")
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, '+Inf')} {count}\n")
+                lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {total}\n")
+                lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {count}\n")
+        return "".join(lines)
+
+
+# Parsing
+PARSE_SECONDS = Histogram("explainer_parse_seconds", "Time spent extracting the text of a file.", ("file_type",))
+SLIDES_PARSED = Counter("explainer_slides_parsed_total", "Slides (or pages) extracted from uploaded files.",
+                        ("file_type",))
+SLIDES_REUSED = Counter("explainer_slides_reused_total", "Unchanged slides of re-uploaded files whose previous "
+                                                        "explanation was reused.")
+
+# OpenAI API
+API_REQUEST_SECONDS = Histogram("explainer_api_request_seconds", "Latency of the text generation requests.",
+                                ("status",))
+API_REQUESTS = Counter("explainer_api_requests_total", "Text generation requests by HTTP status code.", ("status",))
+API_TOKENS = Counter("explainer_api_tokens_total", "Tokens reported by the API.", ("kind",))
+DECK_CONTEXT_TOKENS = Counter("explainer_deck_context_tokens_total", "Token overhead of the cross-slide context mode: "
+                              "the summary requests and the estimated context added to the prompts.", ("kind",))
+API_FAILOVERS = Counter("explainer_api_failovers_total", "Requests retried on another provider (or after a cooldown) "
+                                                         "by failed provider and reason.", ("provider", "reason"))
+API_PROVIDER_HEALTHY = Gauge("explainer_api_provider_healthy", "1 when the provider receives requests, "
+                                                               "0 during its cooldown.", ("provider",))
+CONCURRENCY_LIMIT = Gauge("explainer_api_concurrency_limit", "Requests in flight allowed by the adaptive limiter.")
+CONCURRENCY_IN_FLIGHT = Gauge("explainer_api_concurrency_in_flight", "Requests in flight in the adaptive limiter.")
+CONCURRENCY_LATENCY = Gauge("explainer_api_concurrency_latency_seconds", "Average request latency seen by the "
+                                                                         "adaptive limiter.")
+CONCURRENCY_BACKOFFS = Counter("explainer_api_concurrency_backoffs_total", "Decreases of the adaptive limit by cause.",
+                               ("reason",))
+
+# Jobs
+JOB_SECONDS = Histogram("explainer_job_seconds", "Wall time of a job, from parsing to the saved JSON output.")
+JOBS = Counter("explainer_jobs_total", "Finished jobs by result.", ("result",))
+FAILED_UPLOADS = Counter("explainer_failed_uploads_total", "Uploads marked failed by cause.", ("reason",))
+QUEUE_DEPTH = Gauge("explainer_queue_depth", "Pending jobs waiting for the scheduler.", ("job_class",))
+QUEUE_WAIT_SECONDS = Histogram("explainer_queue_wait_seconds", "Time between upload and job start.",
+                               ("job_class",))
+RUNNING_JOBS = Gauge("explainer_running_jobs", "Jobs being processed.")
+
+# Outputs
+RENDER_SECONDS = Histogram("explainer_render_seconds", "Time spent writing an output file.", ("format",))
+OUTPUT_CACHE = Counter("explainer_output_cache_total", "Downloads of outputs that were already rendered (hit) "
+                                                       "or had to be rendered (miss).", ("result",))
+
+# Retention
+RETENTION_DELETED = Counter("explainer_retention_deleted_total", "Uploads deleted by the retention service by reason.",
+                            ("reason",))
+RETENTION_FREED_BYTES = Counter("explainer_retention_freed_bytes_total", "Bytes of files deleted by the retention "
+                                                                        "service.")
+STORAGE_BYTES = Gauge("explainer_storage_bytes", "Size of the uploaded files and rendered outputs of the uploads.")
@@ -0,0 +1,219 @@
+"""
+tracing.py
+
+This module records opt-in traces of the explainer jobs (spans for the queue wait, parsing,
+each slide's prompt / request / response, persisting and rendering) and exports them in the
+Chrome trace event format, with the trace and span ids in the event args. It also runs a
+sampled profiler (cProfile, or pyinstrument when installed) on every N-th job.
+"""
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from uuid import uuid4
+
+PROFILER_CPROFILE = "cprofile"
+PROFILER_PYINSTRUMENT = "pyinstrument"
+
+_current_trace = ContextVar("current_trace", default=None)
+_current_span = ContextVar("current_span", default=None)
+_current_lane = ContextVar("current_lane", default=None)
+
+
+class Tracer:
+    """
+    Holds the tracing settings and decides which jobs are profiled.
+    Attributes:
+        enabled (bool): True to record and export the traces of the jobs.
+        profile_every (int): Profile one of every profile_every jobs, 0 to never profile.
+        profiler (str): PROFILER_CPROFILE or PROFILER_PYINSTRUMENT.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.enabled = False
+        self.profile_every = 0
+        self.profiler = PROFILER_CPROFILE
+        self.jobs = 0
+
+    def configure(self, enabled: bool, profile_every: int, profiler: str = PROFILER_CPROFILE):
+        self.enabled = enabled
+        self.profile_every = max(0, profile_every)
+        self.profiler = profiler
+
+    def should_profile(self) -> bool:
+        """
+        Returns:
+            bool: True if the job that calls it should be profiled.
+        """
+        if not self.profile_every:
+            return False
+        with self.lock:
+            self.jobs += 1
+            return self.jobs % self.profile_every == 0
+
+
+tracer = Tracer()
+
+
+class Trace:
+    """
+    The spans recorded for a single trace id, as Chrome trace events.
+    """
+
+    def __init__(self, trace_id: str):
+        self.trace_id = trace_id
+        self.lock = threading.Lock()
+        self.events = []
+
+    def add_span(self, name: str, start: float, end: float, span_id: str, parent_id: str | None, lane,
+                 attributes: dict):
+        """
+        Adds a finished span.
+        Args:
+            name (str): The span name.
+            start (float): The start time, in seconds since the epoch.
+            end (float): The end time, in seconds since the epoch.
+            span_id (str): The span id.
+            parent_id (str | None): The id of the enclosing span.
+            lane: The row the span is drawn on (e.g. the slide number), the thread id if None.
+            attributes (dict): Free attributes of the span.
+        """
+        event = {
+            "name": name,
+            "cat": "explainer",
+            "ph": "X",
+            "ts": int(start * 1_000_000),
+            "dur": max(0, int((end - start) * 1_000_000)),
+            "pid": os.getpid(),
+            "tid": lane if lane is not None else threading.get_ident(),
+            "args": dict(attributes, trace_id=self.trace_id, span_id=span_id, parent_span_id=parent_id)
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def export(self, path: str):
+        """
+        Writes the trace to a Chrome trace JSON file (chrome://tracing, Perfetto).
+        The events of an existing file are kept, so later spans of the same upload (like renders) are added to it.
+        Args:
+            path (str): The path of the trace file, its directory is created if needed.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        events = []
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                events = json.load(file).get("traceEvents", [])
+        with self.lock:
+            events.extend(self.events)
+        with open(path, 'w') as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms", "otherData": {"trace_id": self.trace_id}},
+                      file)
+
+
+@contextmanager
+def start_trace(trace_id: str, paths: list[str]):
+    """
+    Records the spans of the enclosed block (and the tasks it creates) into a new trace,
+    and exports the trace to the given files. Does nothing when tracing is disabled.
+    Args:
+        trace_id (str): The trace id, the uid of the job.
+        paths (list[str]): The trace files to export to.
+    Yields:
+        Trace | None: The trace, or None when tracing is disabled.
+    """
+    if not tracer.enabled:
+        yield None
+        return
+    trace = Trace(trace_id)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        for path in paths:
+            trace.export(path)
+
+
+@contextmanager
+def span(name: str, lane=None, **attributes):
+    """
+    Records the enclosed block as a span of the current trace. Does nothing outside a trace.
+    Args:
+        name (str): The span name.
+        lane (optional): The row the span and its children are drawn on, e.g. the slide number.
+        **attributes: Free attributes of the span.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    span_id = uuid4().hex[:16]
+    parent_id = _current_span.get()
+    span_token = _current_span.set(span_id)
+    lane_token = _current_lane.set(lane) if lane is not None else None
+    span_lane = _current_lane.get()
+    start = time.time()
+    try:
+        yield
+    finally:
+        end = time.time()
+        _current_span.reset(span_token)
+        if lane_token is not None:
+            _current_lane.reset(lane_token)
+        trace.add_span(name, start, end, span_id, parent_id, span_lane, attributes)
+
+
+def add_span(name: str, start: datetime, end: datetime, **attributes):
+    """
+    Adds a span that was not measured by a with block (e.g. the queue wait) to the current trace.
+    Args:
+        name (str): The span name.
+        start (datetime): The start time.
+        end (datetime): The end time.
+        **attributes: Free attributes of the span.
+    """
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start.timestamp(), end.timestamp(), uuid4().hex[:16], _current_span.get(),
+                       _current_lane.get(), attributes)
+
+
+@contextmanager
+def profile(path: str):
+    """
+    Profiles the enclosed block when the tracer samples it, and writes the profile next to the outputs:
+    a cProfile stats file (path + ".prof") or a pyinstrument HTML report (path + ".profile.html").
+    Args:
+        path (str): The output path without extension, e.g. outputs/<uid>, its directory is created if needed.
+    """
+    if not tracer.should_profile():
+        yield
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    if tracer.profiler == PROFILER_PYINSTRUMENT:
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+        if Profiler is not None:
+            profiler = Profiler(async_mode="enabled")
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                with open(path + ".profile.html", 'w') as file:
+                    file.write(profiler.output_html())
+            return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path + ".prof")
@@ -1,3 +1,3 @@
-from read_data.file_parser import extract_text
+from read_data.file_parser import extract_text, count_slides, get_file_type
 
 
@@ -1,10 +1,38 @@
-from read_data.pdf_parser import read_pdf
-from read_data.pptx_parser import read_pptx
+import os
+
+from monitoring.metrics import PARSE_SECONDS, SLIDES_PARSED
+# The parsers import python-pptx and PyPDF2, they are loaded the first time a file of their type is parsed
+
+
+def get_file_type(path_to_file: str) -> str:
+    """
+    Returns:
+        str: The lowercase extension of the file, e.g. '.pdf' for lecture.PDF.
+    """
+    return os.path.splitext(path_to_file)[1].lower()
 
 
 def extract_text(path_to_file: str) -> list[str]:
-    if path_to_file.endswith('.pptx'):
-        return read_pptx(path_to_file)
-    if path_to_file.endswith('.pdf'):
-        return read_pdf(path_to_file)
-    return []
\ No newline at end of file
+    file_type = get_file_type(path_to_file)
+    with PARSE_SECONDS.time(file_type=file_type):
+        if file_type == '.pptx':
+            from read_data.pptx_parser import read_pptx
+            slides = read_pptx(path_to_file)
+        elif file_type == '.pdf':
+            from read_data.pdf_parser import read_pdf
+            slides = read_pdf(path_to_file)
+        else:
+            slides = []
+    SLIDES_PARSED.inc(len(slides), file_type=file_type)
+    return slides
+
+
+def count_slides(path_to_file: str) -> int:
+    file_type = get_file_type(path_to_file)
+    if file_type == '.pptx':
+        from read_data.pptx_parser import count_pptx_slides
+        return count_pptx_slides(path_to_file)
+    if file_type == '.pdf':
+        from read_data.pdf_parser import count_pdf_pages
+        return count_pdf_pages(path_to_file)
+    return 0
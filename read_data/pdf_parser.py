@@ -10,3 +10,8 @@ def read_pdf(path_to_pdf: str) -> list[str]:
             page = pdf_reader.pages[page_number]
             pages_text.append(page.extract_text().strip())
         return pages_text
+
+
+def count_pdf_pages(path_to_pdf: str) -> int:
+    with open(path_to_pdf, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
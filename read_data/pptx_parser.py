@@ -22,6 +22,17 @@ def read_pptx(path_to_presentation: str) -> List[str]:
     return slides_text
 
 
+def count_pptx_slides(path_to_presentation: str) -> int:
+    """
+    Counts the slides of a PowerPoint presentation without extracting their text.
+    Args:
+        path_to_presentation (str): The file path to the PowerPoint presentation.
+    Returns:
+        int: The number of slides, including slides without text.
+    """
+    return len(Presentation(path_to_presentation).slides)
+
+
 def extract_text_from_shape(shape) -> str:
     """
     Extracts text content from a PowerPoint shape, including nested shapes, tables, and groups.
@@ -0,0 +1,45 @@
+import asyncio
+
+from api.adaptive_limiter import AdaptiveLimiter
+
+
+def test_limit_adapts_and_persists(tmp_path):
+    """
+    The limit grows while the latency stays flat, backs off on a rate limited request,
+    and the learned limit is loaded by a new limiter.
+    """
+    state_path = str(tmp_path / "concurrency.json")
+    limiter = AdaptiveLimiter(enabled=True, initial_limit=4, max_limit=50, state_path=state_path)
+
+    async def request(latency: float, dropped: bool = False):
+        async with limiter.measure() as sample:
+            await asyncio.sleep(latency)
+            sample.dropped = dropped
+
+    async def load(requests: int, latency: float):
+        await asyncio.gather(*(request(latency) for _ in range(requests)))
+
+    asyncio.run(load(100, 0.001))
+    grown = limiter.limit
+    assert grown > 4
+    asyncio.run(request(0.001, dropped=True))
+    assert limiter.limit < grown
+    limiter.save()
+    assert AdaptiveLimiter(enabled=True, state_path=state_path).limit == round(limiter.limit, 3)
+
+
+def test_limit_is_enforced():
+    limiter = AdaptiveLimiter(enabled=True, initial_limit=3, max_limit=3)
+    in_flight = []
+
+    async def request():
+        async with limiter.measure():
+            in_flight.append(limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    async def load():
+        await asyncio.gather(*(request() for _ in range(20)))
+
+    asyncio.run(load())
+    assert max(in_flight) == 3
+    assert limiter.in_flight == 0
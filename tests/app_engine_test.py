@@ -0,0 +1,42 @@
+import asyncio
+import os
+
+from api.api_request import ApiRequest
+from app_engine import get_output_bases, parse_args, process_documents
+from benchmarks.corpus import make_pdf
+
+
+def test_output_bases():
+    """
+    Every input gets its own outputs: the whole name up to the extension is kept, inputs that would share outputs
+    or whose output would replace an input keep their extension, and a number is added when that's not enough.
+    """
+    paths = [os.path.join("a", "lecture.v1.pdf"), os.path.join("a", "lecture.v2.PDF"), os.path.join("a", "deck.pptx"),
+             os.path.join("a", "deck.pdf"), os.path.join("b", "deck.pdf")]
+    output_bases = get_output_bases(paths, formats=["json", "pdf"])
+    assert output_bases[paths[0]] == os.path.join("a", "lecture.v1_pdf")
+    # lecture.v2.pdf would replace lecture.v2.PDF on a case-insensitive filesystem
+    assert output_bases[paths[1]] == os.path.join("a", "lecture.v2_pdf")
+    assert output_bases[paths[2]] == os.path.join("a", "deck_pptx")
+    assert output_bases[paths[4]] == os.path.join("b", "deck_pdf")
+    output_bases = get_output_bases(paths, "out", ["json"])
+    assert output_bases[paths[0]] == os.path.join("out", "lecture.v1")
+    assert output_bases[paths[1]] == os.path.join("out", "lecture.v2")
+    assert output_bases[paths[3]] == os.path.join("out", "deck_pdf")
+    assert output_bases[paths[4]] == os.path.join("out", "deck_pdf_2")
+
+
+def test_failed_document_has_no_output(tmp_path, monkeypatch):
+    """
+    A document whose slides can't be explained counts as failed and gets no output, so --resume retries it.
+    """
+    async def generate_text(prompt: str, max_tokens: int = None):
+        raise ConnectionError("provider unreachable")
+
+    monkeypatch.setattr(ApiRequest, "generate_text", generate_text)
+    path = make_pdf(str(tmp_path / "deck.pdf"), 2)
+    args = parse_args([path, "--formats", "json", "--resume"])
+    for _ in range(2):
+        summary = asyncio.run(process_documents([path], args))
+        assert (summary["processed"], summary["skipped"], summary["failed"]) == (0, 0, 1)
+    assert not os.path.exists(tmp_path / "deck.json")
@@ -0,0 +1,45 @@
+import asyncio
+
+from api.prompt_generator import get_context_slides, get_deck_context, estimate_tokens
+from api.provider_router import router, Provider
+from api.api_request import ApiRequest
+from api.slide_handler import SlideHandler
+from benchmarks.fake_llm_server import FakeLLMServer
+
+
+def test_deck_context_is_capped():
+    """
+    The context of a slide holds the summaries of the nearest slides and the first slide,
+    in slide order, and never exceeds its token budget.
+    """
+    assert get_context_slides(5, 10) == [4, 6, 3, 2, 1]
+    assert get_context_slides(1, 3) == [2]
+    summaries = {index: f"summary of slide {index} " * 5 for index in get_context_slides(5, 10)}
+    context = get_deck_context(summaries, max_tokens=60)
+    assert context.splitlines()[0].startswith("Page 4:")
+    assert "Page 1:" not in context
+    assert estimate_tokens(context) <= 60
+
+
+def test_deck_context_mode():
+    """
+    In the cross-slide context mode every slide is summarized, and explained with the outline of its neighbours.
+    """
+    server = FakeLLMServer(latency=0.01, jitter=0).start()
+
+    async def explain():
+        async with ApiRequest.client():
+            return await SlideHandler.response_handler(["Intro", "Queues", "", "Caches"], deck_context=True)
+
+    try:
+        router.configure([Provider("fake", server.base_url)])
+        responses = asyncio.run(explain())
+    finally:
+        router.configure(None)
+        server.stop()
+    assert len(responses) == 4
+    assert server.stats()["requests"] == 6
+    assert "Outline of the surrounding pages" in responses[1]["choices"][0]["message"]["content"]
+    assert responses[1]["context_tokens"] > 0
+    assert responses[1]["summary_usage"]["prompt_tokens"] > 0
+    assert responses[2]["choices"]["message"]["content"] == "3"
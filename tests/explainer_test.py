@@ -0,0 +1,87 @@
+import asyncio
+from concurrent.futures import Future
+from datetime import datetime
+
+import pytest
+
+from api.api_request import ApiRequest
+from api.slide_handler import SlideHandler
+from flask_app import setup_app
+from flask_imp.db_model import Session, Upload, UploadStatus
+from flask_imp.flask_explainer import create_job, finish_jobs, get_upload_filename
+from flask_imp.flask_retention import delete_upload
+from flask_imp.flask_scheduler import scheduler, Job, ANONYMOUS_USER
+from flask_imp.flask_util import upload_file_path
+from monitoring.metrics import JOBS, FAILED_UPLOADS
+
+
+@pytest.fixture(autouse=True)
+def app_setup():
+    setup_app()
+
+
+def test_batch_failure_is_isolated(monkeypatch):
+    """
+    A slide that fails in a batch (raised, or answered an error after its last attempt) only fails its own file,
+    the other files keep their explanations.
+    """
+    async def generate_text(prompt: str, max_tokens: int = None):
+        if "broken" in prompt:
+            raise ConnectionError("provider unreachable")
+        if "limited" in prompt:
+            return {"error": {"message": "Rate limit reached"}}
+        return {"choices": [{"message": {"content": "explained"}}]}
+
+    monkeypatch.setattr(ApiRequest, "generate_text", generate_text)
+    responses = asyncio.run(SlideHandler.batch_response_handler([(["Intro", "broken slide"], ""), (["Queues"], ""),
+                                                                 (["limited slide", "Caches"], "")]))
+    assert responses[0] is None
+    assert responses[1][0]["choices"][0]["message"]["content"] == "explained"
+    assert responses[2] is None
+
+
+def test_failed_upload_is_not_done():
+    """
+    The uploads of a job without a result (a failed explanation or a missing file) are marked failed, not done.
+    """
+    with Session() as session:
+        uploads = [Upload(filename=filename, upload_time=datetime.now()) for filename in ("a.pdf", "b.pdf", "c.pdf")]
+        session.add_all(uploads)
+        session.commit()
+        uids = [upload.uid for upload in uploads]
+        filenames = [get_upload_filename(upload) for upload in uploads]
+    job = Job(uids, [(filename, "", False) for filename in filenames], ANONYMOUS_USER, 0, 3, datetime.now())
+    assert scheduler.next_jobs([job], 1) == [job]
+    future = Future()
+    future.set_result({filenames[0]: {"parse_seconds": 0.1, "failed": True},
+                       filenames[1]: {"parse_seconds": 0.1, "total_seconds": 0.2}})
+    jobs_done, jobs_error = JOBS.get(result="done"), JOBS.get(result="error")
+    failed_uploads = FAILED_UPLOADS.get(reason="no_result")
+    with Session() as session:
+        finish_jobs(session, {future: job})
+        statuses = [session.query(Upload).filter_by(uid=uid).one().status for uid in uids]
+    assert statuses == [UploadStatus.failed, UploadStatus.done, UploadStatus.failed]
+    assert JOBS.get(result="done") == jobs_done + 1
+    assert JOBS.get(result="error") == jobs_error
+    assert FAILED_UPLOADS.get(reason="no_result") == failed_uploads + 2
+    for uid in uids:
+        delete_upload(uid)
+
+
+def test_unreadable_upload_fails():
+    """
+    An upload that can't be counted (a corrupt pdf) is marked failed without stopping the other uploads of its job.
+    """
+    with Session() as session:
+        uploads = [Upload(filename=filename, upload_time=datetime.now()) for filename in ("corrupt.pdf", "missing.pdf")]
+        session.add_all(uploads)
+        session.commit()
+        with open(upload_file_path(get_upload_filename(uploads[0]), create=True), 'wb') as file:
+            file.write(b"%PDF-1.4")
+        job = create_job(session, uploads)
+        uids = [upload.uid for upload in uploads]
+        assert uploads[0].status == UploadStatus.failed
+        assert job.uids == uids[1:]
+        assert create_job(session, uploads[:1]) is None
+    for uid in uids:
+        delete_upload(uid)
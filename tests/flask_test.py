@@ -1,7 +1,16 @@
 import pytest
+import os
 from flask_app import app, setup_app
-from tests.test_util import clear_resource
+from datetime import datetime
+from flask_imp.db_model import generate_uid, Session, Upload, UploadStatus
+from flask_imp.result_store import ResultStore
+from flask_imp.flask_util import output_file_path, upload_file_path
+from flask_imp.flask_retention import delete_upload_files
+from write_data.output_manage import OutputManage
+from tests.test_util import clear_resource, clear_batch
+import io
 import json
+import zipfile
 
 # Define the path to your file
 FILE_PATH = 'can you.pptx'
@@ -68,3 +77,127 @@ def test_upload_status(client):
     status = data["status"]
     assert status == "pending"
     clear_resource(uid)
+
+
+def test_download_conditional_and_range(client):
+    """
+    Test case for the download route ("/download/<uid>/<file_type>").
+    It writes an output file and asserts that the download supports ETag revalidation,
+    HTTP Range and the pre-compressed gzip variant.
+    """
+    uid = generate_uid()
+    OutputManage.save_to_json([{"content": "First slide"}], output_file_path(f"{uid}.json", create=True))
+    response = client.get(f'/download/{uid}/json')
+    assert response.status_code == 200
+    assert b"First slide" in response.data
+    etag = response.headers['ETag']
+    response = client.get(f'/download/{uid}/json', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    response = client.get(f'/download/{uid}/json', headers={'Range': 'bytes=0-0'})
+    assert response.status_code == 206
+    assert response.data == b"["
+    response = client.get(f'/download/{uid}/json', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.status_code == 200
+    response = client.get(f'/download/{uid}/exe')
+    assert response.status_code == 404
+    delete_upload_files(uid, "")
+
+
+def test_upload_batch(client):
+    """
+    Test case for the batch upload route ("/upload/batch") and the batch status route ("/batch/<batch_uid>").
+    It uploads two documents and a zip archive in one request and asserts the aggregate progress of the batch.
+    """
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w') as zip_file:
+        zip_file.writestr('course/lecture 3.pdf', b'%PDF-1.4')
+        zip_file.writestr('course/notes.txt', b'skipped')
+    archive.seek(0)
+    files = [(io.BytesIO(b'%PDF-1.4'), 'lecture 1.pdf'), (io.BytesIO(b'%PDF-1.4'), 'lecture 2.pdf'),
+             (archive, 'course.zip')]
+    response = client.post('/upload/batch', data={'files': files, 'email': 'batch@test.com'})
+    assert response.status_code == 200
+    data = json.loads(response.data)
+    assert len(data['uids']) == 3
+    response = client.get(f"/batch/{data['batch_uid']}")
+    assert response.status_code == 200
+    progress = json.loads(response.data)
+    assert progress['total'] == 3
+    assert progress['pending'] == 3
+    assert sorted(upload['filename'] for upload in progress['uploads']) == ['lecture 1.pdf', 'lecture 2.pdf',
+                                                                           'lecture 3.pdf']
+    upload_paths = [upload_file_path(f"{uid}.pdf") for uid in data['uids']]
+    assert all(os.path.exists(path) for path in upload_paths)
+    clear_batch(data['batch_uid'])
+    response = client.get(f"/batch/{data['batch_uid']}")
+    assert response.status_code == 404
+    assert not any(os.path.exists(path) for path in upload_paths)
+
+
+def test_metrics(client):
+    """
+    Test case for the metrics route ("/metrics").
+    It downloads an existing output and asserts the output cache hit is exposed in the Prometheus format.
+    """
+    uid = generate_uid()
+    OutputManage.save_to_txt([{"content": "First slide"}], output_file_path(f"{uid}.txt", create=True))
+    client.get(f'/download/{uid}/txt')
+    response = client.get('/metrics')
+    assert response.status_code == 200
+    assert b'# TYPE explainer_render_seconds histogram' in response.data
+    assert b'explainer_render_seconds_count{format="txt"}' in response.data
+    assert b'explainer_output_cache_total{result="hit"}' in response.data
+    delete_upload_files(uid, "")
+
+
+def test_status_slides(client):
+    """
+    Test case for the slide routes ("/status/<uid>/slides" and "/status/<uid>/slides/<slide_number>").
+    It stores the explanations of a done upload and asserts single slide and range reads,
+    and the lossless JSON export of the download route.
+    """
+    with Session() as session:
+        upload = Upload(filename='slides.pdf', upload_time=datetime.now(), status=UploadStatus.done)
+        session.add(upload)
+        session.commit()
+        uid = upload.uid
+    contents = [f"Explanation {slide_number}" for slide_number in range(1, 6)]
+    ResultStore.save(uid, contents)
+    response = client.get(f'/status/{uid}/slides/3')
+    assert response.status_code == 200
+    assert json.loads(response.data) == {"slide_number": 3, "content": "Explanation 3"}
+    assert client.get(f'/status/{uid}/slides/6').status_code == 404
+    data = json.loads(client.get(f'/status/{uid}/slides?from=2&to=4').data)
+    assert data['count'] == 5
+    assert [slide['slide_number'] for slide in data['slides']] == [2, 3, 4]
+    response = client.get(f'/download/{uid}/json')
+    assert json.loads(response.data) == [{"slide_number": slide_number, "content": content}
+                                         for slide_number, content in enumerate(contents, start=1)]
+    clear_resource(uid)
+    assert ResultStore.count(uid) == 0
+
+
+def test_search_results(client):
+    """
+    Test case for the full-text search route ("/search/results").
+    It stores the explanations of a done upload and asserts that filename matches rank first,
+    that explanation matches point to their slide, and that deleted uploads are no longer found.
+    """
+    with Session() as session:
+        upload = Upload(filename='thermodynamics lecture.pdf', upload_time=datetime.now(), status=UploadStatus.done,
+                        prompt='explain for students')
+        session.add(upload)
+        session.commit()
+        uid = upload.uid
+    ResultStore.save(uid, ["Entropy always increases", "Heat engines and thermodynamics cycles"])
+    assert client.get('/search/results').status_code == 400
+    data = json.loads(client.get('/search/results?q=thermodynamic').data)
+    assert data['total'] == 2
+    assert [(result['uid'], result['slide_number']) for result in data['results']] == [(uid, 0), (uid, 2)]
+    data = json.loads(client.get('/search/results?q=entropy "increases"&per_page=1').data)
+    assert data['results'][0]['slide_number'] == 1
+    assert '[Entropy]' in data['results'][0]['snippet']
+    assert json.loads(client.get('/search/results?q=entropy&page=2&per_page=1').data)['results'] == []
+    clear_resource(uid)
+    assert json.loads(client.get('/search/results?q=entropy').data)['total'] == 0
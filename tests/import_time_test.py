@@ -0,0 +1,12 @@
+from benchmarks.import_time import measure_import, IMPORT_TARGETS
+
+
+def test_lazy_imports():
+    """
+    Starting the web app or the CLI must not import the renderers, the parsers, the API client or tkinter,
+    and must stay within twice the import time target (the margin absorbs slow CI machines).
+    """
+    for module, target in IMPORT_TARGETS.items():
+        result = min((measure_import(module) for _ in range(3)), key=lambda sample: sample["seconds"])
+        assert result["loaded"] == [], f"{module} imported {result['loaded']} at startup"
+        assert result["seconds"] <= 2 * target, f"{module} took {result['seconds']:.3f}s to import"
@@ -0,0 +1,69 @@
+import io
+from datetime import datetime
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from flask_app import setup_app
+from flask_imp.db_model import Session, Upload, UploadStatus
+from flask_imp.flask_retention import delete_upload
+from flask_imp.flask_util import save_upload_with_user, get_or_create_user
+from flask_imp.result_store import ResultStore, hash_slide
+
+EMAIL = "incremental@test.com"
+
+
+@pytest.fixture(autouse=True)
+def app_setup():
+    setup_app()
+
+
+def upload(filename: str = "deck.pdf") -> str:
+    return save_upload_with_user(FileStorage(io.BytesIO(b"%PDF-1.4"), filename), EMAIL, "")
+
+
+def finished_upload(filename: str = "deck.pdf", status: UploadStatus = UploadStatus.done) -> str:
+    """
+    Adds an upload that is already explained (or failed), which the explainer of the system test never picks up.
+    """
+    with Session() as session:
+        finished = Upload(filename=filename, upload_time=datetime.now(), user=get_or_create_user(session, EMAIL),
+                          status=status)
+        session.add(finished)
+        session.commit()
+        return finished.uid
+
+
+def test_reuse_unchanged_slides():
+    """
+    A new upload of the same file by the same user is linked to the latest explained one, skipping a later
+    failed upload, and the explanations of its unchanged slides are found at their new slide numbers after
+    a slide is inserted and one deleted.
+    """
+    parent_uid = finished_upload()
+    ResultStore.save(parent_uid, ["Intro", "Queues", "Caches", "Summary"],
+                     [hash_slide(text) for text in ["intro", "queues", "caches", "summary"]])
+    failed_uid = finished_upload(status=UploadStatus.failed)
+    uid = upload()
+    other_uid = upload("other.pdf")
+    with Session() as session:
+        assert session.query(Upload).filter_by(uid=uid).one().parent.uid == parent_uid
+        assert session.query(Upload).filter_by(uid=other_uid).one().parent is None
+    text_hashes = [hash_slide(text) for text in ["intro", "new slide", "queues", "  summary ", ""]]
+    assert ResultStore.get_reusable(uid, text_hashes) == {1: "Intro", 3: "Queues", 4: "Summary"}
+    for upload_uid in (uid, other_uid, failed_uid, parent_uid):
+        delete_upload(upload_uid)
+
+
+def test_errors_are_not_reused():
+    """
+    A slide answered with an API error is explained again by the next upload, the other slides are reused.
+    """
+    parent_uid = finished_upload("errors.pdf")
+    text_hashes = [hash_slide(text) for text in ["intro", "queues"]]
+    ResultStore.save_responses(parent_uid, [{"choices": [{"message": {"content": "Intro"}}]},
+                                            {"error": {"message": "Rate limit reached"}}], text_hashes)
+    uid = upload("errors.pdf")
+    assert ResultStore.get_reusable(uid, text_hashes) == {1: "Intro"}
+    for upload_uid in (uid, parent_uid):
+        delete_upload(upload_uid)
@@ -0,0 +1,70 @@
+import asyncio
+from collections import Counter
+
+from api.api_request import ApiRequest
+from api.provider_router import router, ProviderRouter, Provider
+from benchmarks.fake_llm_server import FakeLLMServer
+
+
+def test_weighted_choice():
+    """
+    The providers of the lowest tier share the requests in proportion to their weights,
+    and the fallback tier is only used when the whole primary tier is cooling down.
+    """
+    providers = [Provider("a", weight=3), Provider("b", weight=1), Provider("fallback", tier=1)]
+    provider_router = ProviderRouter(providers, seed=1)
+    counts = Counter(provider_router.choose().name for _ in range(2000))
+    assert counts["fallback"] == 0
+    assert 2.5 < counts["a"] / counts["b"] < 3.5
+    provider_router.record_failure(providers[0], "429", retry_after=30)
+    provider_router.record_failure(providers[1], "timeout")
+    assert provider_router.choose().name == "fallback"
+    assert provider_router.choose(exclude={"fallback"}) is None
+
+
+def test_failover_to_secondary():
+    """
+    Requests rejected by a rate limited primary provider are answered by the secondary one.
+    """
+    primary = FakeLLMServer(latency=0.01, jitter=0, rate_429=1.0).start()
+    secondary = FakeLLMServer(latency=0.01, jitter=0).start()
+
+    async def explain():
+        async with ApiRequest.client():
+            return await asyncio.gather(*(ApiRequest.generate_text(f"slide {index}") for index in range(10)))
+
+    try:
+        router.configure([Provider("primary", primary.base_url, model="primary-model"),
+                          Provider("secondary", secondary.base_url, model="secondary-model", tier=1)])
+        responses = asyncio.run(explain())
+    finally:
+        router.configure(None)
+        primary.stop()
+        secondary.stop()
+    assert all(response["model"] == "secondary-model" for response in responses)
+    assert primary.stats()["requests"] >= 1
+    assert secondary.stats()["requests"] == 10
+
+
+def test_failover_on_html_error_page():
+    """
+    A primary provider answering with an HTML error page (a failing proxy) fails over to the secondary one.
+    """
+    primary = FakeLLMServer(latency=0.01, jitter=0, rate_502=1.0).start()
+    secondary = FakeLLMServer(latency=0.01, jitter=0).start()
+
+    async def explain():
+        async with ApiRequest.client():
+            return await asyncio.gather(*(ApiRequest.generate_text(f"slide {index}") for index in range(5)))
+
+    try:
+        router.configure([Provider("primary", primary.base_url, model="primary-model"),
+                          Provider("secondary", secondary.base_url, model="secondary-model", tier=1)])
+        responses = asyncio.run(explain())
+    finally:
+        router.configure(None)
+        primary.stop()
+        secondary.stop()
+    assert all(response["model"] == "secondary-model" for response in responses)
+    assert primary.stats()["requests"] >= 1
+    assert secondary.stats()["requests"] == 5
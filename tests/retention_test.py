@@ -0,0 +1,93 @@
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine
+
+from flask_app import setup_app
+from flask_imp import db_model, search_index
+from flask_imp.db_model import Session, Upload, UploadStatus, engine
+from flask_imp.flask_retention import retention, run_retention, delete_upload
+from flask_imp.flask_util import upload_file_path, output_file_path
+from flask_imp.result_store import ResultStore
+
+
+@pytest.fixture(autouse=True)
+def app_setup(tmp_path, monkeypatch):
+    """
+    Runs each test against a database and uploads and outputs folders of its own in tmp_path,
+    the retention runs of the tests would otherwise delete the uploads of the working directory.
+    """
+    test_engine = create_engine(f"sqlite:///{tmp_path / 'db.sqlite3'}")
+    monkeypatch.setattr(db_model, "engine", test_engine)
+    monkeypatch.setattr(search_index, "engine", test_engine)
+    Session.remove()
+    Session.configure(bind=test_engine)
+    monkeypatch.chdir(tmp_path)
+    setup_app()
+    yield
+    retention.configure(max_age_days=0, max_idle_days=0, max_bytes=0)
+    Session.remove()
+    Session.configure(bind=engine)
+    test_engine.dispose()
+
+
+def make_upload(days_ago: int, size: int) -> str:
+    """
+    Creates a processed upload finished days_ago days ago, with an uploaded file and a JSON output of size bytes.
+    Returns:
+        str: The UID of the upload.
+    """
+    finish_time = datetime.now() - timedelta(days=days_ago)
+    with Session() as session:
+        upload = Upload(filename="lecture.pdf", upload_time=finish_time, finish_time=finish_time,
+                        status=UploadStatus.done, storage_bytes=2 * size)
+        session.add(upload)
+        session.commit()
+        uid = upload.uid
+    for path in (upload_file_path(f"{uid}.pdf", create=True), output_file_path(f"{uid}.json", create=True)):
+        with open(path, 'wb') as file:
+            file.write(b"x" * size)
+    ResultStore.save(uid, ["First slide"])
+    return uid
+
+
+def exists(uid: str) -> bool:
+    with Session() as session:
+        found = session.query(Upload).filter_by(uid=uid).first() is not None
+    return found or os.path.exists(upload_file_path(f"{uid}.pdf")) or os.path.exists(output_file_path(f"{uid}.json"))
+
+
+def test_files_are_sharded():
+    uid = make_upload(days_ago=0, size=10)
+    path = upload_file_path(f"{uid}.pdf")
+    assert os.path.dirname(os.path.dirname(os.path.dirname(path))) == "uploads"
+    retention.configure(max_age_days=0, max_idle_days=0, max_bytes=1)
+    run_retention()
+    assert not exists(uid)
+
+
+def test_expire_by_age():
+    old_uid, new_uid = make_upload(days_ago=40, size=10), make_upload(days_ago=1, size=10)
+    retention.configure(max_age_days=30, max_idle_days=0, max_bytes=0)
+    deleted = run_retention()
+    assert deleted["age"] == 1
+    assert not exists(old_uid)
+    assert ResultStore.count(old_uid) == 0
+    assert exists(new_uid)
+    delete_upload(new_uid)
+
+
+def test_expire_least_recently_used():
+    """
+    Above the storage budget the uploads read least recently are deleted first.
+    """
+    first, second = make_upload(days_ago=3, size=100), make_upload(days_ago=2, size=100)
+    with Session() as session:
+        session.query(Upload).filter_by(uid=first).update({Upload.last_access: datetime.now()})
+        session.commit()
+    retention.configure(max_age_days=0, max_idle_days=0, max_bytes=300)
+    assert run_retention()["size"] == 1
+    assert exists(first)
+    assert not exists(second)
+    delete_upload(first)
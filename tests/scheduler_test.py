@@ -0,0 +1,35 @@
+from datetime import datetime, timedelta
+from flask_imp.flask_scheduler import JobScheduler, Job, SCHEDULE_SMALL_FIRST
+
+
+def make_job(uid: str, user_key: str, slides: int, priority: int = 0, age: int = 0) -> Job:
+    return Job(uids=[uid], files=[(f"{uid}.pdf", "", False)], user_key=user_key, priority=priority, slides=slides,
+               upload_time=datetime.now() - timedelta(seconds=age))
+
+
+def test_fair_share():
+    """
+    A user with many pending jobs must not starve the others: jobs are started round-robin between users,
+    the smaller jobs of each user first.
+    """
+    scheduler = JobScheduler(workers=4, policy=SCHEDULE_SMALL_FIRST, max_jobs_per_user=2)
+    jobs = [make_job(f"a{i}", "a", slides=10 + i, age=100) for i in range(5)] + [make_job("b0", "b", slides=50)]
+    started = scheduler.next_jobs(jobs, slots=4)
+    assert [job.uids[0] for job in started] == ["a0", "b0", "a1"]
+    assert scheduler.stats()['running_jobs'] == 3
+    assert scheduler.stats()['queue']['small']['depth'] == 3
+    scheduler.finish(started[0])
+    assert [job.uids[0] for job in scheduler.next_jobs(jobs[2:5], slots=1)] == ["a2"]
+
+
+def test_priority_and_budget():
+    """
+    Priority users are served first, and a user over the hourly slide budget waits.
+    """
+    scheduler = JobScheduler(workers=4, max_jobs_per_user=4, max_slides_per_hour=30)
+    jobs = [make_job("a0", "a", slides=20, age=100), make_job("a1", "a", slides=20),
+            make_job("p0", "p", slides=100, priority=1)]
+    started = scheduler.next_jobs(jobs, slots=4)
+    assert [job.uids[0] for job in started] == ["p0", "a0"]
+    assert scheduler.stats()['queue']['priority']['started'] == 1
+    assert scheduler.next_jobs([jobs[1]], slots=4) == []
@@ -1,12 +1,10 @@
-from flask_imp.db_model import Upload
-import os
+from flask_imp.db_model import Batch
+from flask_imp.flask_retention import delete_upload
 
 
 def clear_resource(upload_uid: str):
-    for file in os.listdir('uploads'):
-        if file.startswith(upload_uid):
-            os.remove(os.path.join('uploads', file))
-    for file in os.listdir('outputs'):
-        if file.startswith(upload_uid):
-            os.remove(os.path.join('outputs', file))
-    Upload.delete_by_uid(upload_uid)
\ No newline at end of file
+    delete_upload(upload_uid)
+
+
+def clear_batch(batch_uid: str):
+    Batch.delete_by_uid(batch_uid)
@@ -0,0 +1,46 @@
+import asyncio
+import json
+from monitoring.tracing import tracer, start_trace, span
+
+
+def test_trace_export(tmp_path):
+    """
+    The spans of a trace, including the spans of the asyncio tasks it creates,
+    are exported as Chrome trace events linked to their parent span.
+    """
+    async def slide(index: int):
+        with span("slide", lane=index, slide=index):
+            with span("request"):
+                await asyncio.sleep(0)
+
+    async def explain():
+        await asyncio.gather(*(asyncio.create_task(slide(index)) for index in (1, 2)))
+
+    trace_path = str(tmp_path / "job.trace.json")
+    tracer.configure(enabled=True, profile_every=0)
+    try:
+        with start_trace("job", [trace_path]):
+            with span("explain"):
+                asyncio.run(explain())
+    finally:
+        tracer.configure(enabled=False, profile_every=0)
+    with open(trace_path) as file:
+        events = json.load(file)["traceEvents"]
+    spans = {(event["name"], event["tid"]): event for event in events if event["name"] != "explain"}
+    explain_span = next(event for event in events if event["name"] == "explain")
+    assert len(events) == 5
+    assert spans[("slide", 2)]["args"]["parent_span_id"] == explain_span["args"]["span_id"]
+    assert spans[("request", 2)]["args"]["parent_span_id"] == spans[("slide", 2)]["args"]["span_id"]
+    assert all(event["args"]["trace_id"] == "job" and event["ph"] == "X" for event in events)
+
+
+def test_tracing_disabled(tmp_path):
+    """
+    Nothing is recorded or written when tracing is disabled.
+    """
+    trace_path = tmp_path / "job.trace.json"
+    with start_trace("job", [str(trace_path)]) as trace:
+        with span("explain"):
+            pass
+    assert trace is None
+    assert not trace_path.exists()
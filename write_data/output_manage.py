@@ -1,9 +1,14 @@
+import gzip
 import json
 import os
 import re
-from fpdf import FPDF
-from docx import Document
-from bidi.algorithm import get_display
+from monitoring.metrics import RENDER_SECONDS
+# fpdf, python-docx, bidi and brotli are imported when a format is first rendered, so importing this module is cheap
+
+# The font is looked up next to this module, so outputs can be rendered from any working directory
+FONT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Arial.ttf')
+# Encodings of the pre-compressed variants written next to text outputs, in order of preference
+PRECOMPRESSED_ENCODINGS = {"br": ".br", "gzip": ".gz"}
 
 
 class OutputManage:
@@ -36,13 +41,15 @@ class OutputManage:
         return [response.get("content") for response in responses]
 
     @staticmethod
-    def save_to_json(responses: list[dict], user_path: str) -> str:
+    @RENDER_SECONDS.time(format="json")
+    def save_to_json(responses: list[dict], user_path: str, precompress: bool = True) -> str:
         """
         Saves the responses to a JSON file.
 
         Args:
             responses (list[dict]): The list of responses to be saved.
             user_path (str): The path of the user's input file.
+            precompress (bool, optional): True to write the compressed copies served by the web app.
 
         Returns:
             str: The path of the saved JSON file.
@@ -55,9 +62,12 @@ class OutputManage:
 
         with open(output_file, 'w') as f:
             json.dump(slide_list, f, indent=4)
+        if precompress:
+            OutputManage.save_precompressed(output_file)
         return output_file
 
     @staticmethod
+    @RENDER_SECONDS.time(format="pdf")
     def save_to_pdf(responses: list[dict], user_path: str) -> str:
         """
         Saves the responses to a pdf file.
@@ -69,11 +79,13 @@ class OutputManage:
         Returns:
             str: The path of the saved pdf file.
         """
+        from fpdf import FPDF
+        from bidi.algorithm import get_display
         output_file = os.path.splitext(user_path)[0] + ".pdf"
         content_list = OutputManage.get_content(responses)
         pdf = FPDF('P', 'mm', 'Letter')
         pdf.set_auto_page_break(auto=True, margin=15)
-        pdf.add_font('Arial', '', 'write_data/Arial.ttf', uni=True)
+        pdf.add_font('Arial', '', FONT_PATH, uni=True)
         pdf.set_font("Arial", size=12)
         for page_number, page_content in enumerate(content_list, start=1):
             pdf.add_page()
@@ -86,13 +98,15 @@ class OutputManage:
         return output_file
 
     @staticmethod
-    def save_to_txt(responses: list[dict], user_path: str) -> str:
+    @RENDER_SECONDS.time(format="txt")
+    def save_to_txt(responses: list[dict], user_path: str, precompress: bool = True) -> str:
         """
         Saves the responses to a txt file.
 
         Args:
             responses (list[dict]): The list of responses to be saved.
             user_path (str): The path of the user's input file.
+            precompress (bool, optional): True to write the compressed copies served by the web app.
 
         Returns:
             str: The path of the saved txt file.
@@ -101,9 +115,41 @@ class OutputManage:
         content_list = OutputManage.get_content(responses)
         with open(output_file, 'w') as f:
             f.write('\n\n'.join(content_list))
+        if precompress:
+            OutputManage.save_precompressed(output_file)
         return output_file
 
     @staticmethod
+    def save_precompressed(output_file: str) -> list[str]:
+        """
+        Writes gzip (and brotli, when available) compressed copies of an output file,
+        so the web server can send them as is instead of compressing on every download.
+        Args:
+            output_file (str): The path of the output file to compress.
+        Returns:
+            list[str]: The paths of the compressed files.
+        """
+        try:
+            import brotli
+        except ImportError:  # brotli is optional, only gzip variants are written without it
+            brotli = None
+        with open(output_file, 'rb') as f:
+            data = f.read()
+        compressed_files = []
+        for encoding, suffix in PRECOMPRESSED_ENCODINGS.items():
+            if encoding == "br":
+                if brotli is None:
+                    continue
+                compressed = brotli.compress(data)
+            else:
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+            with open(output_file + suffix, 'wb') as f:
+                f.write(compressed)
+            compressed_files.append(output_file + suffix)
+        return compressed_files
+
+    @staticmethod
+    @RENDER_SECONDS.time(format="docx")
     def save_to_docx(responses: list[dict], user_path: str) -> str:
         """
         Saves the responses to a docx file.
@@ -113,6 +159,7 @@ class OutputManage:
             Returns:
                 str: The path of the saved docx file.
         """
+        from docx import Document
         output_file = os.path.splitext(user_path)[0] + ".docx"
         content_list = OutputManage.get_content(responses)
         document = Document()